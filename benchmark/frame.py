@@ -0,0 +1,53 @@
+""" Microbenchmark of parsing and serializing each type of HTTP/2 frame.
+
+usage: python -m benchmark.frame [number]
+"""
+import sys
+import logging
+from timeit import timeit
+
+from hpack import Encoder
+
+from server.frame import FrameBase, FrameTypes, HeadersFlags, ErrorCodes
+
+
+def samples():
+    """ Returns a list of pairs of a name and a frame. """
+    settings = FrameBase.create(FrameTypes.SETTINGS.value, 0x0, 0)
+    settings.header_table_size = 4096
+    settings.max_concurrent_streams = 100
+    settings.initial_window_size = 1 << 20
+    settings.max_frame_size = 16384
+
+    headers = FrameBase.create(FrameTypes.HEADERS.value, HeadersFlags.END_HEADERS.value, 1)
+    headers.encoder = Encoder()
+    for k, v in ((':status', '200'), ('content-type', 'text/html;charset=utf-8'),
+                 ('server', 'SimpleServer'), ('content-length', '16384')):
+        headers[k] = v
+
+    return [
+        ('DATA', FrameBase.create(FrameTypes.DATA.value, 0x1, 1, b'x' * 16384)),
+        ('HEADERS', headers),
+        ('PRIORITY', FrameBase.create(FrameTypes.PRIORITY.value, 0x0, 3, b'\x00\x00\x00\x01\x0f')),
+        ('RST_STREAM', FrameBase.create(FrameTypes.RST_STREAM.value, 0x0, 1, ErrorCodes.CANCEL.to_bytes())),
+        ('SETTINGS', settings),
+        ('GOAWAY', FrameBase.create(FrameTypes.GOAWAY.value, 0x0, 0,
+                                    b'\x00\x00\x00\x01' + ErrorCodes.NO_ERROR.to_bytes())),
+        ('WINDOW_UPDATE', FrameBase.create(FrameTypes.WINDOW_UPDATE.value, 0x0, 0,
+                                           (1 << 16).to_bytes(4, 'big'))),
+        ('CONTINUATION', FrameBase.create(FrameTypes.CONTINUATION.value, 0x4, 1, b'\x88' * 64)),
+    ]
+
+
+def main(number=100000):
+    logging.disable(logging.CRITICAL)
+    print('{:14} {:>10} {:>10}'.format('frame', 'load', 'save'))
+    for name, frame in samples():
+        data = frame.save()
+        load = timeit(lambda: FrameBase.load(data), number=number)
+        save = timeit(frame.save, number=number)
+        print('{:14} {:7.2f} us {:7.2f} us'.format(name, load / number * 1e6, save / number * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,101 @@
+""" Writes to the transport and throughput of an HTTP/2 connection.
+A client sends requests in batches of concurrent streams on one connection
+and the server counts its calls of transport.write/writelines. Each call is
+one send(2) while the socket buffer is not full.
+
+usage: python -m benchmark.h2write [number] [concurrency]
+"""
+import sys
+import time
+import socket
+import asyncio
+import logging
+
+import h2.config
+import h2.events
+import h2.connection
+
+from server import util
+from server.rsock import create_socket
+from server.server import MyHTTPServer
+
+
+class CountingServer(MyHTTPServer):
+    """ Counts the writes of the connections of this server. """
+    writes = 0
+
+    async def client_connected_cb(self, reader, writer):
+        transport = writer.transport
+        write = transport.write
+
+        def counting_write(data):
+            self.writes += 1
+            write(data)
+
+        def counting_writelines(data):
+            # the default writelines() calls write(), which must not be counted twice
+            self.writes += 1
+            write(b''.join(data))
+
+        transport.write, transport.writelines = counting_write, counting_writelines
+        await super().client_connected_cb(reader, writer)
+
+
+async def client(port, number, concurrency):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.transport.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=True))
+    conn.initiate_connection()
+    writer.write(conn.data_to_send())
+
+    sent = done = 0
+    while done < number:
+        batch = min(concurrency, number - sent)
+        for _ in range(batch):
+            conn.send_headers(conn.get_next_available_stream_id(),
+                              [(':method', 'GET'), (':path', '/'),
+                               (':scheme', 'http'), (':authority', 'localhost')],
+                              end_stream=True)
+        sent += batch
+        writer.write(conn.data_to_send())
+
+        while done < sent:
+            data = await reader.read(65536)
+            if not data:
+                raise ConnectionError('the server closed the connection')
+            for event in conn.receive_data(data):
+                if isinstance(event, h2.events.DataReceived):
+                    conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                elif isinstance(event, h2.events.StreamEnded):
+                    done += 1
+            writer.write(conn.data_to_send())
+    writer.close()
+
+
+async def run(number, concurrency):
+    router = util.RouteRecord()
+
+    @router.route('GET', '/')
+    def index():
+        return 'Hello, world!'
+
+    server = CountingServer(router)
+    sock = create_socket(('127.0.0.1', 0))
+    async with await server.run(sock=sock):
+        start = time.perf_counter()
+        await client(sock.getsockname()[1], number, concurrency)
+        elapsed = time.perf_counter() - start
+    return server.writes, elapsed
+
+
+def main(number=10000, concurrency=20):
+    logging.disable(logging.CRITICAL)
+    writes, elapsed = asyncio.run(run(number, concurrency))
+
+    print('{} requests, {} concurrent streams'.format(number, concurrency))
+    print('writes       {:8} ({:.2f} per response)'.format(writes, writes / number))
+    print('throughput   {:8.0f} requests/s'.format(number / elapsed))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,48 @@
+""" Microbenchmark of serializing the header section of a response.
+Compares headers.make_head with building message.Headers, formatting
+the date on every response and serializing it with Headers.save.
+
+usage: python -m benchmark.headers [number]
+"""
+import sys
+import asyncio
+import logging
+from timeit import timeit
+from http import HTTPStatus
+from datetime import datetime, timezone
+
+from server import message
+from server.headers import make_head, date_cache, HeaderBlock, DEFAULT_FIELDS
+
+
+def legacy(length):
+    x = [message.Header('Date', datetime.now(tz=timezone.utc).strftime('%a, %d %b %Y %H:%M:%S %Z')),
+         message.Header('Server', 'SimpleServer'),
+         message.Header('Content-Type', 'text/html;charset=utf-8'),
+        ]
+    headers = message.Headers(headers=x)
+    headers.set_header(message.Header('Content-Length', length))
+    headers.set_header(message.Header('Connection', 'keep-alive'))
+    return (message.StatusLine('HTTP/1.1', HTTPStatus.OK).save() + headers.save()).encode('utf-8')
+
+
+block = HeaderBlock({**DEFAULT_FIELDS, 'Cache-Control': 'no-cache', 'X-Frame-Options': 'DENY'})
+
+def cached(length):
+    return make_head(200, length=length)
+
+def route_block(length):
+    return make_head(200, block, length=length)
+
+
+async def main(number=100000):
+    logging.disable(logging.CRITICAL)
+    date_cache.start()
+    for fn in (legacy, cached, route_block):
+        t = timeit(lambda: fn(1234), number=number)
+        print('{:12} {:8.3f} us/response'.format(fn.__name__, t / number * 1e6))
+    date_cache.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(*[int(x) for x in sys.argv[1:]]))
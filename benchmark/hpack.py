@@ -0,0 +1,39 @@
+""" Header bytes per response over 1000 responses on one HTTP/2 connection.
+Compares an HPACK encoder shared by the connection with a new encoder
+for every HEADERS frame.
+
+usage: python -m benchmark.hpack [number]
+"""
+import sys
+import logging
+from hpack import Encoder
+
+from server.frame import FrameBase, FrameTypes, HeadersFlags
+from server.headers import date_cache, DEFAULT_FIELDS
+
+
+def response_headers(encoder, i):
+    frame = FrameBase.create(FrameTypes.HEADERS.value, HeadersFlags.END_HEADERS.value, 2 * i + 1)
+    frame.encoder = encoder
+    frame[':status'] = 200
+    frame['date'] = date_cache.value
+    for k, v in DEFAULT_FIELDS.items():
+        frame[k.lower()] = v
+    frame['content-length'] = str(1000 + i % 10)
+    frame['cache-control'] = 'no-cache'
+    return len(frame.save())
+
+
+def main(number=1000):
+    logging.disable(logging.CRITICAL)
+    shared = Encoder()
+    per_connection = sum(response_headers(shared, i) for i in range(number))
+    per_frame = sum(response_headers(Encoder(), i) for i in range(number))
+
+    print('{} responses'.format(number))
+    print('encoder per frame      {:8} bytes, {:6.1f} bytes/response'.format(per_frame, per_frame / number))
+    print('encoder per connection {:8} bytes, {:6.1f} bytes/response'.format(per_connection, per_connection / number))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,276 @@
+""" End-to-end load benchmark. Starts MyHTTPServer in a child process with a
+self-signed certificate (generated by the openssl command) and drives it with
+an asyncio load generator in this process. Scenarios are HTTP/1.1 with and
+without keep-alive and h2 with many concurrent streams, each over plaintext
+and TLS. Reports requests per second, p50/p99/p999 latency and the RSS of the
+server, and saves the results as JSON. Give a former JSON file to --compare
+to print the change of each number.
+
+usage: python -m benchmark.load [--duration 5] [--concurrency 50] [--streams 100]
+                                [--scenario NAME ...] [--output results.json]
+                                [--compare baseline.json]
+"""
+import os
+import sys
+import ssl
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+
+import h2.config
+import h2.events
+import h2.connection
+
+from server import util
+from server.rsock import create_socket
+from server.server import MyHTTPServer
+
+BODY = b'Hello, world!'
+
+
+def make_certificate(directory):
+    """ Generate a self-signed certificate for localhost. Returns a pair of the paths of the certificate and the key. """
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-subj', '/CN=localhost', '-keyout', keyfile, '-out', certfile],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return certfile, keyfile
+
+
+def serve(sock, certfile, keyfile):
+    """ The server process. """
+    logging.disable(logging.CRITICAL)
+    router = util.RouteRecord()
+
+    @router.route('GET', '/')
+    def index():
+        return BODY
+
+    MyHTTPServer(router, certfile=certfile, keyfile=keyfile).serve_forever(sock=sock)
+
+
+def start_server(certfile=None, keyfile=None):
+    """ Start a server process. Returns a pair of the process and the port. """
+    sock = create_socket(('127.0.0.1', 0), backlog=1024)
+    process = multiprocessing.get_context('fork').Process(target=serve, args=(sock, certfile, keyfile), daemon=True)
+    process.start()
+    port = sock.getsockname()[1]
+    sock.close()
+    return process, port
+
+
+def rss(pid):
+    """ Returns a pair of the current and the peak resident set size of a process in KiB. """
+    values = {}
+    try:
+        with open('/proc/{}/status'.format(pid)) as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('VmRSS', 'VmHWM'):
+                    values[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return values.get('VmRSS'), values.get('VmHWM')
+
+
+def client_context(alpn):
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    context.set_alpn_protocols([alpn])
+    return context
+
+
+class Recorder(object):
+    """ Collects latencies of the requests which finish before the deadline. """
+    def __init__(self, duration):
+        self.deadline = time.perf_counter() + duration
+        self.latencies = []
+        self.errors = 0
+
+    @property
+    def running(self):
+        return time.perf_counter() < self.deadline
+
+
+async def read_response(reader):
+    """ Read a response. Returns False when the server closes the connection after it. """
+    head = await reader.readuntil(b'\r\n\r\n')
+    length = 0
+    keep_alive = True
+    for line in head.split(b'\r\n'):
+        name = line[:15].lower()
+        if name == b'content-length:':
+            length = int(line[15:])
+        elif name == b'connection: clo':
+            keep_alive = False
+    await reader.readexactly(length)
+    if not head.startswith(b'HTTP/1.1 200'):
+        raise ConnectionError(head.split(b'\r\n', 1)[0].decode('latin-1'))
+    return keep_alive
+
+
+async def http1_client(port, recorder, context, keep_alive):
+    request = b'GET / HTTP/1.1\r\nHost: localhost\r\n' + \
+              (b'\r\n' if keep_alive else b'Connection: close\r\n\r\n')
+    writer = None
+    while recorder.running:
+        start = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port, ssl=context,
+                                                               server_hostname='localhost' if context else None)
+            writer.write(request)
+            reused = await read_response(reader)
+        except (OSError, asyncio.IncompleteReadError, ConnectionError):
+            recorder.errors += 1
+            writer = None
+            continue
+        recorder.latencies.append(time.perf_counter() - start)
+        if not (keep_alive and reused):
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def h2_client(port, recorder, context, streams):
+    """ Keep streams requests in flight on one connection. """
+    reader, writer = await asyncio.open_connection('127.0.0.1', port, ssl=context,
+                                                   server_hostname='localhost' if context else None)
+    conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=True))
+    conn.initiate_connection()
+    headers = [(':method', 'GET'), (':path', '/'), (':scheme', 'https' if context else 'http'),
+               (':authority', 'localhost')]
+    started = {}
+
+    def send():
+        stream_id = conn.get_next_available_stream_id()
+        conn.send_headers(stream_id, headers, end_stream=True)
+        started[stream_id] = time.perf_counter()
+
+    for _ in range(streams):
+        send()
+    writer.write(conn.data_to_send())
+
+    while started:
+        data = await reader.read(65536)
+        if not data:
+            recorder.errors += len(started)
+            break
+        for event in conn.receive_data(data):
+            if isinstance(event, h2.events.DataReceived):
+                conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+            elif isinstance(event, h2.events.StreamEnded):
+                recorder.latencies.append(time.perf_counter() - started.pop(event.stream_id))
+                if recorder.running:
+                    send()
+            elif isinstance(event, h2.events.StreamReset):
+                recorder.errors += 1
+                started.pop(event.stream_id, None)
+                if recorder.running:
+                    send()
+        writer.write(conn.data_to_send())
+    writer.close()
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run_scenario(name, port, tls, args):
+    protocol, _, mode = name.partition('-')
+    context = client_context('h2' if protocol == 'h2' else 'http/1.1') if tls else None
+    recorder = Recorder(args.duration)
+    start = time.perf_counter()
+    if protocol == 'h2':
+        await h2_client(port, recorder, context, args.streams)
+    else:
+        await asyncio.gather(*[http1_client(port, recorder, context, mode == 'keepalive')
+                               for _ in range(args.concurrency)])
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(recorder.latencies)
+    ms = lambda x: None if x is None else round(x * 1e3, 3)
+    return {'requests': len(latencies),
+            'errors': recorder.errors,
+            'rps': round(len(latencies) / elapsed, 1),
+            'p50_ms': ms(percentile(latencies, 0.5)),
+            'p99_ms': ms(percentile(latencies, 0.99)),
+            'p999_ms': ms(percentile(latencies, 0.999)),
+            }
+
+
+SCENARIOS = ('http1-keepalive', 'http1-close', 'h2-streams')
+
+
+def compare(results, baseline):
+    print('\nchange from the baseline')
+    for name, result in results.items():
+        old = baseline.get('results', {}).get(name)
+        if not old:
+            continue
+        changes = []
+        for k in ('rps', 'p50_ms', 'p99_ms', 'p999_ms', 'rss_kb'):
+            if result.get(k) and old.get(k):
+                changes.append('{} {:+.1f}%'.format(k, (result[k] - old[k]) / old[k] * 100))
+        print('{:22} {}'.format(name, ', '.join(changes)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='End-to-end load benchmark of MyHTTPServer.')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per scenario')
+    parser.add_argument('--concurrency', type=int, default=50, help='HTTP/1.1 connections')
+    parser.add_argument('--streams', type=int, default=100, help='concurrent h2 streams')
+    parser.add_argument('--scenario', nargs='*', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--no-tls', action='store_true', help='skip the TLS scenarios')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of former results')
+    args = parser.parse_args(argv)
+    logging.disable(logging.CRITICAL)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        certfile, keyfile = (None, None) if args.no_tls else make_certificate(directory)
+        for tls in (False,) if args.no_tls else (False, True):
+            process, port = start_server(certfile if tls else None, keyfile if tls else None)
+            try:
+                time.sleep(0.2)
+                for scenario in args.scenario:
+                    name = '{}-{}'.format(scenario, 'tls' if tls else 'plain')
+                    result = asyncio.run(run_scenario(scenario, port, tls, args))
+                    result['rss_kb'], result['peak_rss_kb'] = rss(process.pid)
+                    results[name] = result
+                    print('{:22} {:9.1f} req/s  p50 {} ms  p99 {} ms  p999 {} ms  rss {} KiB  errors {}'.format(
+                        name, result['rps'], result['p50_ms'], result['p99_ms'],
+                        result['p999_ms'], result['rss_kb'], result['errors']))
+            finally:
+                process.terminate()
+                process.join()
+
+    report = {'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+              'python': sys.version.split()[0],
+              'platform': platform.platform(),
+              'cpus': os.cpu_count(),
+              'options': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+              'results': results,
+              }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
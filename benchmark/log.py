@@ -0,0 +1,72 @@
+""" Overhead of the log decorator of logger.get_logger_set at INFO level.
+Compares a bare function, the decorator (which returns the function itself
+when DEBUG is disabled), the decorator applied while DEBUG was enabled and
+the former decorator which always formatted the arguments.
+
+usage: python -m benchmark.log [number]
+"""
+import sys
+import asyncio
+import logging
+from functools import wraps
+from timeit import timeit
+
+from server.logger import get_logger_set
+from server import message
+
+logger, log = get_logger_set('benchmark')
+
+
+def eager_log(fn):
+    """ The former decorator. """
+    @wraps(fn)
+    def wrapper(*args, **kwds):
+        logger.debug('{}({}, {})'.format(fn.__name__, args, kwds))
+        res = fn(*args, **kwds)
+        return res
+    return wrapper
+
+
+def handle(request, keep_alive=True):
+    return keep_alive
+
+
+async def handle_async(request, keep_alive=True):
+    return keep_alive
+
+
+def main(number=200000):
+    request = message.RequestParser(b'GET /index.html HTTP/1.1\r\n'
+                                    b'Host: localhost\r\n'
+                                    b'Accept: text/html\r\n'
+                                    b'\r\n').head()
+
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    traced, traced_async = log(handle), log(handle_async)
+    logger.setLevel(logging.INFO)
+    disabled, disabled_async = log(handle), log(handle_async)
+
+    print('sync, INFO level')
+    for name, fn in (('bare', handle),
+                     ('log', disabled),
+                     ('log applied at DEBUG', traced),
+                     ('former log', eager_log(handle))):
+        t = timeit(lambda: fn(request, keep_alive=False), number=number)
+        print('  {:22} {:7.3f} us/call'.format(name, t / number * 1e6))
+
+    async def run(fn):
+        for _ in range(number):
+            await fn(request, keep_alive=False)
+
+    print('async, INFO level')
+    for name, fn in (('bare', handle_async),
+                     ('log', disabled_async),
+                     ('log applied at DEBUG', traced_async)):
+        t = timeit(lambda: asyncio.run(run(fn)), number=1)
+        print('  {:22} {:7.3f} us/call'.format(name, t / number * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
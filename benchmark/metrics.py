@@ -0,0 +1,79 @@
+""" Overhead of the metrics subsystem.
+Times the updates done per request, exposition of the registry, and HTTP/1.1
+requests on a keep-alive connection with metrics and with no-op metrics.
+
+usage: python -m benchmark.metrics [number]
+"""
+import sys
+import time
+import asyncio
+import logging
+from timeit import timeit
+
+from server import util, metrics
+from server.rsock import create_socket
+from server.server import MyHTTPServer
+
+
+class Noop(object):
+    def inc(self, *args):
+        pass
+
+    dec = inc
+
+
+async def keep_alive(number):
+    router = util.RouteRecord()
+
+    @router.route('GET', '/user/{id:int}')
+    def user(id):
+        return 'user'
+
+    sock = create_socket(('127.0.0.1', 0))
+    async with await MyHTTPServer(router, max_keep_alive_requests=number + 1).run(sock=sock):
+        reader, writer = await asyncio.open_connection(*sock.getsockname())
+        request = b'GET /user/1 HTTP/1.1\r\nHost: localhost\r\n\r\n'
+        start = time.perf_counter()
+        for _ in range(number):
+            writer.write(request)
+            await reader.readuntil(b'user')
+        elapsed = time.perf_counter() - start
+        writer.close()
+    return elapsed
+
+
+def main(number=100000):
+    logging.disable(logging.CRITICAL)
+    t = timeit(lambda: metrics.requests.inc(('http/1.1', 'GET', '/user/{id:int}', 200)), number=number)
+    print('Counter.inc            {:7.3f} us'.format(t / number * 1e6))
+    t = timeit(lambda: metrics.request_duration.observe(0.003, ('/user/{id:int}',)), number=number)
+    print('Histogram.observe      {:7.3f} us'.format(t / number * 1e6))
+    t = timeit(lambda: metrics.record_request('http/1.1', 'GET', '/user/{id:int}', 200, 0.003), number=number)
+    print('record_request         {:7.3f} us'.format(t / number * 1e6))
+
+    for i in range(100):
+        metrics.record_request('http/1.1', 'GET', '/route{}'.format(i), 200, 0.001 * i)
+    t = timeit(metrics.registry.expose, number=100)
+    print('expose, 100 routes     {:7.3f} ms'.format(t / 100 * 1e3))
+
+    requests = number // 10
+    names = ('connections', 'active_connections', 'requests', 'errors', 'bytes_received', 'bytes_sent',
+             'record_request')
+    enabled = {k: getattr(metrics, k) for k in names}
+    disabled = {k: Noop() for k in names}
+    disabled['record_request'] = lambda *args: None
+
+    elapsed = {'metrics': 0.0, 'no-op metrics': 0.0}
+    for _ in range(3): # alternate, so that both get a warm process
+        for name, values in (('metrics', enabled), ('no-op metrics', disabled)):
+            for k, v in values.items():
+                setattr(metrics, k, v)
+            elapsed[name] += asyncio.run(keep_alive(requests))
+
+    print('{} keep-alive requests, 3 rounds'.format(requests))
+    for name, t in elapsed.items():
+        print('  {:20} {:7.2f} us/request'.format(name, t / 3 / requests * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
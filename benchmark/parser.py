@@ -0,0 +1,78 @@
+""" Microbenchmark of HTTP/1.1 request parsing.
+Compares message.RequestParser, used as the server does (head(), then
+read_body() and load_body()), with the former HTTPMessage.load path
+(decode to str, then io.StringIO, split and re.match per header line).
+
+usage: python -m benchmark.parser [number]
+"""
+import sys
+import logging
+from timeit import timeit
+
+from server import message
+
+GET = (b'GET /index.html HTTP/1.1\r\n'
+       b'Host: localhost:8080\r\n'
+       b'User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:62.0) Gecko/20100101 Firefox/62.0\r\n'
+       b'Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n'
+       b'Accept-Language: ja,en-US;q=0.7,en;q=0.3\r\n'
+       b'Accept-Encoding: gzip, deflate, br\r\n'
+       b'Connection: keep-alive\r\n'
+       b'Upgrade-Insecure-Requests: 1\r\n'
+       b'Cache-Control: max-age=0\r\n'
+       b'\r\n')
+
+POST = (b'POST /login HTTP/1.1\r\n'
+        b'Host: localhost:8080\r\n'
+        b'User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:62.0) Gecko/20100101 Firefox/62.0\r\n'
+        b'Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n'
+        b'Content-Type: application/x-www-form-urlencoded\r\n'
+        b'Content-Length: 29\r\n'
+        b'\r\n'
+        b'user=alice&password=secret123')
+
+
+def load(data):
+    return message.HTTPMessage.load(data.decode('utf-8'))
+
+
+def read(parser, request):
+    """ Read the body of request and parse it, as HandlerBase.prepare_body does. """
+    if parser.request is request:
+        data, done = parser.read_body()
+        if data:
+            request.body = message.RequestParser.load_body(request.headers, data)
+    return request
+
+
+def parse(data):
+    parser = message.RequestParser(data)
+    return read(parser, parser.head())
+
+
+def parse_in_pieces(data, size=16):
+    parser = message.RequestParser()
+    request = None
+    for i in range(0, len(data), size):
+        parser.feed(data[i:i + size])
+        if request is None:
+            request = parser.head()
+    body = b''
+    while parser.request is request: # the body arrives in pieces as well
+        data, done = parser.read_body()
+        body += data
+    if body:
+        request.body = message.RequestParser.load_body(request.headers, body)
+    return request
+
+
+def main(number=20000):
+    logging.disable(logging.CRITICAL)
+    for name, data in (('GET', GET), ('POST', POST)):
+        for fn in (load, parse, parse_in_pieces):
+            t = timeit(lambda: fn(data), number=number)
+            print('{:4} {:16} {:8.2f} us/request'.format(name, fn.__name__, t / number * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
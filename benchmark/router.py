@@ -0,0 +1,64 @@
+""" Microbenchmark of route lookup with 10, 100 and 1000 routes.
+Compares RouteRecord (with and without its LRU cache) with a linear scan
+over compiled regular expressions, which RouteRecord used to do.
+
+usage: python -m benchmark.router [number]
+"""
+import re
+import sys
+import random
+import logging
+from timeit import timeit
+
+from server.util import RouteRecord
+
+
+def make_routes(n):
+    """ Half of the routes are static, the others have an int parameter. """
+    return ['/api/v1/resource{}/items'.format(i) if i % 2 else '/api/v1/resource{}/{{id:int}}'.format(i)
+            for i in range(n)]
+
+
+def make_paths(n, k=1000):
+    rand = random.Random(n)
+    paths = []
+    for _ in range(k):
+        i = rand.randrange(n)
+        paths.append('/api/v1/resource{}/items'.format(i) if i % 2 else '/api/v1/resource{}/{}'.format(i, rand.randrange(10**6)))
+    return paths
+
+
+class LinearRouter(object):
+    def __init__(self, routes):
+        self.regex_ = [(re.compile(r.replace('{id:int}', '[0-9]+') + '$'), r) for r in routes]
+
+    def find(self, path):
+        for k, v in self.regex_:
+            if k.match(path):
+                return v
+        raise KeyError(path)
+
+
+def main(number=20000):
+    logging.disable(logging.CRITICAL)
+    for n in (10, 100, 1000):
+        routes = make_routes(n)
+        paths = make_paths(n)
+
+        linear = LinearRouter(routes)
+        cached = RouteRecord()
+        uncached = RouteRecord(cache_size=0)
+        for router in (cached, uncached):
+            for r in routes:
+                router[r] = (main, ['GET'])
+
+        for name, find in (('linear regex', linear.find),
+                           ('trie', uncached.find),
+                           ('trie + LRU', cached.find)):
+            it = iter(paths * (number // len(paths) + 1))
+            t = timeit(lambda: find(next(it)), number=number)
+            print('{:5} routes {:13} {:8.2f} us/lookup'.format(n, name, t / number * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,133 @@
+import time
+import asyncio
+from collections import deque
+
+# private programs
+from . import message
+from . import metrics
+from .util import Priority
+from .logger import get_logger_set
+logger, log = get_logger_set('admission')
+
+
+class Admission(object):
+    """ Admission control of a server, shared by all of its connections.
+    At most max_connections connections are served and at most max_requests requests
+    are handled at the same time, None for no limit. A request over the limit waits in
+    a queue of queue_size requests for at most queue_timeout seconds. When the queue
+    is full or the wait times out, the request is shed: it is answered with
+    503 and Retry-After of retry_after seconds (REFUSED_STREAM on HTTP/2).
+
+    Requests are admitted by the priority of their route (util.Priority).
+    CRITICAL requests, e.g. health checks, bypass the limits. HIGH requests are
+    admitted before the queued NORMAL ones and take the place of the newest NORMAL
+    request when the queue is full. LOW requests are shed instead of queued.
+    """
+    def __init__(self, *, max_connections=None, max_requests=None, queue_size=100,
+                 queue_timeout=1.0, retry_after=1):
+        self.max_connections = max_connections
+        self.max_requests = max_requests
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.connections = 0
+        self.requests = 0 # requests being handled, without CRITICAL ones
+        self.waiters = {Priority.HIGH: deque(), Priority.NORMAL: deque()} # futures of queued requests
+
+    @property
+    def queued(self):
+        return sum(len(waiters) for waiters in self.waiters.values())
+
+    def connect(self, protocol):
+        """ Count a new connection. Returns False if it must be refused. """
+        if self.max_connections is not None and self.connections >= self.max_connections:
+            metrics.shed.inc((protocol, 'connections'))
+            return False
+        self.connections += 1
+        return True
+
+    def disconnect(self):
+        self.connections -= 1
+
+    def error(self):
+        return message.Shed(self.retry_after)
+
+    def shed(self, protocol, reason):
+        metrics.shed.inc((protocol, reason))
+        return self.error()
+
+    async def acquire(self, priority, protocol):
+        """ Wait until a request of priority can be handled.
+        Raises message.Shed if it is shed.
+        """
+        if priority >= Priority.CRITICAL:
+            return
+        if self.max_requests is None or (self.requests < self.max_requests and not self.queued):
+            self.requests += 1
+            metrics.requests_in_flight.inc()
+            return
+        if priority <= Priority.LOW or self.queue_size <= 0:
+            raise self.shed(protocol, 'priority' if priority <= Priority.LOW else 'queue_full')
+
+        if self.queued >= self.queue_size:
+            normal = self.waiters[Priority.NORMAL]
+            if priority < Priority.HIGH or not normal:
+                raise self.shed(protocol, 'queue_full')
+            # the newest NORMAL request gives its place to this one
+            normal.pop().set_exception(self.shed(protocol, 'queue_full'))
+            metrics.requests_queued.dec()
+
+        waiters = self.waiters[min(priority, Priority.HIGH)]
+        waiter = asyncio.get_running_loop().create_future()
+        waiters.append(waiter)
+        metrics.requests_queued.inc()
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if not waiter.done():
+                waiter.cancel()
+                waiters.remove(waiter)
+                metrics.requests_queued.dec()
+                if isinstance(e, asyncio.TimeoutError):
+                    raise self.shed(protocol, 'queue_timeout')
+                raise
+            if waiter.exception() is not None: # shed while the request was cancelled
+                raise waiter.exception()
+            if isinstance(e, asyncio.CancelledError): # admitted, but the request is gone
+                self.release(priority)
+                raise
+            # admitted at the same time as the timeout
+        finally:
+            metrics.queue_duration.observe(time.perf_counter() - start, (priority.name.lower(),))
+
+    def release(self, priority):
+        """ Finish a request admitted by acquire(). Its slot is passed to the next queued request. """
+        if priority >= Priority.CRITICAL:
+            return
+        for waiters in self.waiters.values():
+            if waiters:
+                waiters.popleft().set_result(None)
+                metrics.requests_queued.dec()
+                return
+        self.requests -= 1
+        metrics.requests_in_flight.dec()
+
+    def admit(self, priority, protocol):
+        """ Returns an async context manager which holds a slot of a request while it is handled. """
+        return _Slot(self, priority, protocol)
+
+
+class _Slot(object):
+    __slots__ = ('admission', 'priority', 'protocol')
+
+    def __init__(self, admission, priority, protocol):
+        self.admission = admission
+        self.priority = priority
+        self.protocol = protocol
+
+    async def __aenter__(self):
+        await self.admission.acquire(self.priority, self.protocol)
+
+    async def __aexit__(self, *exc_info):
+        self.admission.release(self.priority)
@@ -0,0 +1,157 @@
+import time
+import asyncio
+import hashlib
+from http import HTTPStatus
+from collections import OrderedDict
+
+# private programs
+from . import message
+from .headers import HeaderBlock, etag_matches
+from .compression import CODINGS, encoded_etag
+from .logger import get_logger_set
+logger, log = get_logger_set('cache')
+
+
+# header fields sent with 304 (RFC 7232 4.1)
+NOT_MODIFIED_FIELDS = ('Server', 'ETag', 'Cache-Control', 'Expires', 'Vary', 'Content-Location')
+
+
+class CacheEntry(object):
+    """ A response kept by ResponseCache. block is the headers.HeaderBlock of all
+    header fields of the response, which is serialized once, and body is the bytes of the body.
+    expires is the time of time.monotonic() when the entry becomes stale.
+    """
+    __slots__ = ('status', 'block', 'body', 'etag', 'expires', '_not_modified')
+
+    def __init__(self, status, fields, body, etag, expires):
+        self.status = status
+        self.block = HeaderBlock(fields)
+        self.body = body
+        self.etag = etag
+        self.expires = expires
+        self._not_modified = None
+
+    @property
+    def size(self):
+        return len(self.body) + len(self.block.data)
+
+    def matches(self, if_none_match):
+        """ Returns True if the value of If-None-Match matches the ETag of the entry,
+        or the ETag of one of its compressed representations.
+        """
+        return etag_matches(if_none_match, self.etag,
+                            *[encoded_etag(self.etag, coding) for coding in CODINGS])
+
+    def not_modified(self):
+        """ Returns the entry of the 304 response to a request which matches this entry. """
+        if self._not_modified is None:
+            fields = {k: v for k, v in self.block.fields.items() if k in NOT_MODIFIED_FIELDS}
+            self._not_modified = CacheEntry(HTTPStatus.NOT_MODIFIED, fields, b'', self.etag, self.expires)
+        return self._not_modified
+
+
+class ResponseCache(object):
+    """ Opt-in cache of the responses of a route, e.g.
+    @router.route('GET', '/news', cache=ResponseCache(ttl=60, vary=('Accept-Language',)))
+    Entries are keyed by the request URI (the path and the query) and the values of
+    the request header fields named in vary. They are fresh for ttl seconds.
+    At most max_entries entries and max_size bytes are kept, the least recently used
+    entries are evicted first.
+
+    Only 200 responses whose body is in memory are cached. Responses which set cookies
+    or have Cache-Control no-store or private are not. A response without ETag gets
+    a strong ETag made from the hash of its body. Concurrent requests for a missing
+    entry wait for a single call of the route function (single-flight).
+    """
+    def __init__(self, ttl=60.0, *, max_entries=1024, max_size=64 << 20, vary=()):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.vary = tuple(k.title() for k in vary) # the case of request header fields, see message.RequestParser
+        self.entries = OrderedDict()
+        self.pending = {} # key -> asyncio.Future of the entry being created
+        self.size = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def make_key(self, uri, headers):
+        return (uri,) + tuple(headers.get(k) for k in self.vary)
+
+    def get(self, key):
+        """ Returns the fresh entry of key or None. """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires <= time.monotonic():
+            self.discard(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self.discard(key)
+        self.entries[key] = entry
+        self.size += entry.size
+        while len(self.entries) > self.max_entries or self.size > self.max_size:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.size
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def make_entry(self, status, headers, body, block):
+        """ Returns a CacheEntry of a response, or None if the response must not be cached.
+        headers are the header fields given by the route function and block is
+        the headers.HeaderBlock of the route.
+        """
+        if status != HTTPStatus.OK or getattr(headers, 'cookie', None):
+            return None
+        if body is not None and not isinstance(body, message.ResponseBody):
+            return None
+        cache_control = (headers.get('Cache-Control') or block.fields.get('Cache-Control') or '').lower()
+        if 'no-store' in cache_control or 'private' in cache_control:
+            return None
+
+        data = body.save() if body is not None else b''
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        data = bytes(data)
+        if len(data) > self.max_size:
+            return None
+
+        etag = headers.get('ETag') or block.fields.get('ETag') \
+            or '"{}"'.format(hashlib.sha1(data).hexdigest())
+        fields = {**block.fields, **headers, 'ETag': etag}
+        return CacheEntry(status, fields, data, etag, time.monotonic() + self.ttl)
+
+    async def fetch(self, key, create):
+        """ Returns the fresh entry of key. On a miss, create (a coroutine function
+        which returns a CacheEntry or None) is called and its entry is stored.
+        Requests for key while create runs wait for its result instead of calling it again.
+        Returns None if the entry could not be created.
+        """
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+
+        future = self.pending.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = self.pending[key] = asyncio.get_running_loop().create_future()
+        entry = None
+        try:
+            entry = await create()
+            if entry is not None:
+                self.put(key, entry)
+        finally:
+            del self.pending[key]
+            future.set_result(entry)
+        return entry
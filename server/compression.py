@@ -0,0 +1,127 @@
+import zlib
+import asyncio
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# private programs
+from .util import TransferCodings
+from .logger import get_logger_set
+logger, log = get_logger_set('compression')
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _deflate(data, level):
+    return zlib.compress(data, level)
+
+
+def _gzip(data, level):
+    # wbits 31 is the gzip format, zlib writes its header with mtime 0 so that the output is deterministic
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _brotli(data, level):
+    return brotli.compress(data, quality=min(level, 11))
+
+
+# content-coding -> function, in the order of preference of the server
+CODINGS = OrderedDict()
+if brotli is not None:
+    CODINGS['br'] = _brotli
+CODINGS[TransferCodings.GZIP.value] = _gzip
+CODINGS[TransferCodings.DEFLATE.value] = _deflate
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml',
+                      'image/svg+xml')
+
+
+def parse_accept_encoding(value):
+    """ Returns a dict of content-coding -> qvalue of an Accept-Encoding header. """
+    res = {}
+    for item in value.split(','):
+        coding, *params = [x.strip() for x in item.split(';')]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            k, _, v = param.partition('=')
+            if k.strip().lower() == 'q':
+                try:
+                    q = float(v)
+                except ValueError:
+                    q = 0.0
+        res[coding.lower()] = q
+    return res
+
+
+class Compressor(object):
+    """ Compresses response bodies with the content-coding negotiated by Accept-Encoding.
+    Bodies smaller than min_size or of types which are not compressible are sent as they are.
+    Bodies of offload_size bytes or more are compressed in executor (a thread pool), so that
+    the event loop is not blocked. Compressed bodies are kept in an LRU cache of cache_size
+    entries keyed by the ETag of the response, the hash of the body and the coding.
+    The hash is part of every key, since an ETag identifies a body only within one resource.
+    """
+    def __init__(self, *, level=6, min_size=1024, offload_size=65536, cache_size=256,
+                 max_cached_size=1 << 20, executor=None):
+        self.level = level
+        self.min_size = min_size
+        self.offload_size = offload_size
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.max_cached_size = max_cached_size # larger bodies are not cached
+        self.executor = executor
+
+    def negotiate(self, accept_encoding):
+        """ Returns the content-coding to use for an Accept-Encoding header value, or None. """
+        if not accept_encoding:
+            return None
+        accepted = parse_accept_encoding(accept_encoding)
+        default = accepted.get('*', 0.0)
+        best, best_q = None, 0.0
+        for coding in CODINGS:
+            q = accepted.get(coding, default)
+            if q > best_q:
+                best, best_q = coding, q
+        return best
+
+    def compressible(self, content_type, data):
+        if len(data) < self.min_size or not content_type:
+            return False
+        return content_type.lower().startswith(COMPRESSIBLE_TYPES)
+
+    async def compress(self, data, coding, etag=None):
+        """ Returns data compressed with coding. """
+        key = (etag, hashlib.sha1(data).digest(), coding)
+        try:
+            res = self.cache[key]
+            self.cache.move_to_end(key)
+            return res
+        except KeyError:
+            pass
+
+        if len(data) >= self.offload_size:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(thread_name_prefix='compression')
+            loop = asyncio.get_running_loop()
+            res = await loop.run_in_executor(self.executor, CODINGS[coding], data, self.level)
+        else:
+            res = CODINGS[coding](data, self.level)
+
+        if len(data) <= self.max_cached_size:
+            self.cache[key] = res
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return res
+
+
+def encoded_etag(etag, coding):
+    """ A strong ETag must differ between the representations of different codings. """
+    if etag and etag.endswith('"') and not etag.startswith('W/'):
+        return '{}-{}"'.format(etag[:-1], coding)
+    return etag
@@ -0,0 +1,152 @@
+import sys
+import asyncio
+import inspect
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# private programs
+from . import message
+from . import metrics
+from .logger import get_logger_set
+logger, log = get_logger_set('executor')
+
+
+EXECUTORS = ('thread', 'process')
+
+
+def resolve(module, qualname):
+    """ Returns the object named qualname in module, e.g. a route function. """
+    obj = sys.modules.get(module) or __import__(module, fromlist=['_'])
+    for name in qualname.split('.'):
+        obj = getattr(obj, name)
+    return obj
+
+
+def importable(fn):
+    """ Returns True if fn can be found by its module and qualified name in another process. """
+    qualname = getattr(fn, '__qualname__', '')
+    if not qualname or '<locals>' in qualname or '<lambda>' in qualname:
+        return False
+    try:
+        return inspect.unwrap(resolve(fn.__module__, qualname)) is inspect.unwrap(fn)
+    except (AttributeError, ImportError):
+        return False
+
+
+def _call(module, qualname, params):
+    """ Runs in a worker process. Route functions are looked up by name,
+    because the function registered by RouteRecord.route() is not the one bound to its name.
+    """
+    return resolve(module, qualname)(**params)
+
+
+def snapshot(request):
+    """ Returns a copy of request which can be pickled for a worker process. """
+    if request is None:
+        return None
+    body = request.body
+    if isinstance(body, message.RequestStream):
+        raise TypeError('a streamed body cannot be sent to a worker process')
+    return message.HTTPMessage(request.start_line, request.headers, body)
+
+
+class Offload(object):
+    """ Runs synchronous route functions in executors, so that a blocking or CPU-heavy
+    function does not stall the event loop. A route registered with executor='thread'
+    runs in a ThreadPoolExecutor of threads workers, one with executor='process' in a
+    ProcessPoolExecutor of processes workers (None for the defaults of concurrent.futures).
+    When sync is True, other non-coroutine functions run in the thread pool as well.
+
+    At most max_pending calls are submitted to each pool, later ones are answered with 503.
+    A function run in a process must be importable by its module and name, and gets
+    a snapshot of the request which is pickled, as well as its result.
+    Worker processes are started by mp_context, by default a forkserver (spawn where
+    it is not available), so that they do not inherit the sockets of open connections.
+    """
+    def __init__(self, *, threads=None, processes=None, max_pending=256, sync=False, mp_context=None):
+        self.threads = threads
+        self.processes = processes
+        self.max_pending = max_pending
+        self.sync = sync
+        self.mp_context = mp_context
+        self.executors = {}
+        self.workers = {} # the number of workers of each executor
+        self.pending = dict.fromkeys(EXECUTORS, 0) # calls submitted and not finished
+        self.targets = {} # route function -> (module, qualified name) for the process pool
+
+    def kind(self, plan):
+        """ Returns the executor a route function runs in, None for the event loop. """
+        if plan.is_coroutine or plan.executor is False:
+            return None
+        if plan.executor is None:
+            return 'thread' if self.sync else None
+        return plan.executor
+
+    def executor(self, kind):
+        executor = self.executors.get(kind)
+        if executor is None:
+            if kind == 'thread':
+                executor = ThreadPoolExecutor(self.threads, thread_name_prefix='route')
+            else:
+                mp_context = self.mp_context
+                if mp_context is None:
+                    methods = multiprocessing.get_all_start_methods()
+                    mp_context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                executor = ProcessPoolExecutor(self.processes, mp_context=mp_context)
+            self.executors[kind] = executor
+            self.workers[kind] = executor._max_workers
+        return executor
+
+    def target(self, fn):
+        try:
+            return self.targets[fn]
+        except KeyError:
+            pass
+        if not importable(fn):
+            raise TypeError('{!r} cannot be run in a process, it is not importable by its name'.format(fn))
+        res = self.targets[fn] = (fn.__module__, fn.__qualname__)
+        return res
+
+    async def run(self, kind, plan, params):
+        """ Call the route function of plan with params in the executor of kind. """
+        if self.pending[kind] >= self.max_pending:
+            metrics.executor_rejected.inc((kind,))
+            raise message.Shed()
+
+        if kind == 'process':
+            if 'request' in params:
+                params = dict(params, request=snapshot(params['request']))
+            future = self.executor(kind).submit(_call, *self.target(plan.fn), params)
+        else:
+            future = self.executor(kind).submit(lambda: plan.fn(**params))
+
+        # the call is pending until it finishes in the executor, even if the request is cancelled
+        loop = asyncio.get_running_loop()
+        self.pending[kind] += 1
+        self.update(kind)
+        future.add_done_callback(lambda f: self.finished(loop, kind))
+        return await asyncio.wrap_future(future)
+
+    def finished(self, loop, kind):
+        """ Called by a thread of the executor when a call finishes. """
+        try:
+            loop.call_soon_threadsafe(self.finish, kind)
+        except RuntimeError: # the event loop is closed
+            pass
+
+    def finish(self, kind):
+        self.pending[kind] -= 1
+        self.update(kind)
+
+    def update(self, kind):
+        pending = self.pending[kind]
+        metrics.executor_pending.set(pending, (kind,))
+        metrics.executor_queued.set(max(0, pending - self.workers.get(kind, 0)), (kind,))
+
+    def shutdown(self, wait=True):
+        for executor in self.executors.values():
+            if sys.version_info >= (3, 9):
+                executor.shutdown(wait=wait, cancel_futures=True)
+            else: # calls which have not started are run before the executor stops
+                executor.shutdown(wait=wait)
+        self.executors.clear()
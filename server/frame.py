@@ -1,6 +1,7 @@
-import typing
+import struct
 from enum import Enum, auto
-from io import BytesIO
+from collections import deque
+from collections.abc import MutableMapping
 from hpack import Encoder, Decoder
 
 # private programs
@@ -18,11 +19,66 @@ class FrameTypes(Enum):
     PING = b'\x06'
     GOAWAY = b'\x07'
     WINDOW_UPDATE = b'\x08'
-    COTINUATION = b'\x09'
+    CONTINUATION = b'\x09'
+    COTINUATION = b'\x09' # misspelled alias of CONTINUATION
+
+
+class ErrorCodes(Enum):
+    """ Error codes of RST_STREAM and GOAWAY frames (RFC 7540 7). """
+    NO_ERROR = 0x0
+    PROTOCOL_ERROR = 0x1
+    INTERNAL_ERROR = 0x2
+    FLOW_CONTROL_ERROR = 0x3
+    SETTINGS_TIMEOUT = 0x4
+    STREAM_CLOSED = 0x5
+    FRAME_SIZE_ERROR = 0x6
+    REFUSED_STREAM = 0x7
+    CANCEL = 0x8
+    COMPRESSION_ERROR = 0x9
+    CONNECT_ERROR = 0xa
+    ENHANCE_YOUR_CALM = 0xb
+    INADEQUATE_SECURITY = 0xc
+    HTTP_1_1_REQUIRED = 0xd
+
+    def to_bytes(self):
+        return self.value.to_bytes(4, 'big', signed=False)
+
+
+# the 9 bytes header of a frame. The 24 bits length is packed as a byte and a short.
+FRAME_HEADER = struct.Struct('>BHcBL')
+FRAME_HEADER_SIZE = FRAME_HEADER.size
+_uint32 = struct.Struct('>L')
+_priority = struct.Struct('>LB')
+_setting = struct.Struct('>HL')
+_goaway = struct.Struct('>LL')
+
+
+class FrameSizeError(Exception):
+    """ The payload of a received frame has a wrong length (RFC 7540 4.2). """
+
+
+def check_length(frame, data, size, exact=True):
+    """ Raises FrameSizeError if data is not size bytes (at least size bytes if exact is False). """
+    length = len(data) if data is not None else 0
+    if length < size or exact and length != size:
+        raise FrameSizeError('{} frame of {} bytes'.format(frame.FrameType().name, length))
+
+
+def pack_header(length, type_, flags, stream_identifier):
+    return FRAME_HEADER.pack(length >> 16, length & 0xffff, type_, flags, stream_identifier)
+
+
+def unpack_header(data):
+    """ Returns a tuple of length, type, flags and stream identifier of the frame header in data. """
+    high, low, type_, flags, stream_identifier = FRAME_HEADER.unpack_from(data)
+    return high << 16 | low, type_, flags, stream_identifier & 0x7fffffff
 
 
 class FrameBase(object):
-    """docstring for FrameBase"""
+    """ Base class of frames. A subclass parses the payload given to its constructor,
+    which may be a memoryview of the received data, and save() returns the frame as bytes.
+    """
+    __slots__ = ('length', 'type_', 'flags', 'stream_identifier')
     factory = None
 
     def __init__(self, length: int, type_, flags: int, stream_identifier: int):
@@ -30,11 +86,6 @@ class FrameBase(object):
         self.type_ = type_
         self.flags = flags
         self.stream_identifier = stream_identifier
-        logger.debug('type={}, '.format(self.type_) +\
-                     'flag={}, '.format(self.flags) +\
-                     'stream_identifier={} '.format(self.stream_identifier) +\
-                     'and payload size={}'.format(self.length))
-
 
     @classmethod
     def get_factory(cls):
@@ -45,91 +96,71 @@ class FrameBase(object):
     @classmethod
     def create(cls, type_, flags, stream_identifier, data=None):
         factory = cls.get_factory()
-        if not data:
-            length = 0
-        else:
-            length = len(data)
-        logger.info('length of the data is {}'.format(length))
+        length = len(data) if data else 0
         return factory[type_](length, type_, flags, stream_identifier, data)
 
     @classmethod
     def load(cls, data):
-        factory = cls.get_factory()
-
-        length = int.from_bytes(data[:3], 'big', signed=False)
-        type_ = data[3:4]
-        flags = int.from_bytes(data[4:5], 'big', signed=False)
-        stream_identifier = int.from_bytes(data[5:9], 'big', signed=False)
-        payload = data[9:]
-        return factory[type_](length, type_, flags, stream_identifier, payload)
+        """ Parse a frame from data, which starts with the frame header. """
+        length, type_, flags, stream_identifier = unpack_header(data)
+        payload = memoryview(data)[FRAME_HEADER_SIZE:FRAME_HEADER_SIZE + length]
+        return cls.get_factory()[type_](length, type_, flags, stream_identifier, payload)
 
     def save(self):
-        res = b''
-        res += self.length.to_bytes(3, 'big', signed=False)
-        res += self.type_
-        res += self.flags.to_bytes(1, 'big', signed=False)
-        res += self.stream_identifier.to_bytes(4, 'big', signed=False)
-
-        return res
+        return pack_header(self.length, self.type_, self.flags, self.stream_identifier)
 
     @staticmethod
     def FrameType():
-        raise NotImplementedException('A subclass of FrameBase should implement FrameType() method')
+        raise NotImplementedError('A subclass of FrameBase should implement FrameType() method')
+
+
+class SettingParameters(Enum):
+    """ Identifiers of SETTINGS parameters (RFC 7540 6.5.2). """
+    HEADER_TABLE_SIZE = 0x1
+    ENABLE_PUSH = 0x2
+    MAX_CONCURRENT_STREAMS = 0x3
+    INITIAL_WINDOW_SIZE = 0x4
+    MAX_FRAME_SIZE = 0x5
+    MAX_HEADER_LIST_SIZE = 0x6
+
+
+# identifier -> attribute name of SettingFrame
+_setting_names = {x.value: x.name.lower() for x in SettingParameters}
 
 
 class SettingFrame(FrameBase):
-    """docstring for SettingFrame"""
-    initial_window_size = None
+    """ SETTINGS frame. A parameter is an attribute named after the lower case
+    of SettingParameters. It is None when the frame does not have it.
+    """
+    __slots__ = tuple(_setting_names.values())
+
     def __init__(self, length: int, type_, flags: int, stream_identifier: int, data=None):
         super(SettingFrame, self).__init__(length, type_, flags, stream_identifier)
-        logger.debug('SettingFrame is called.')
-
-        self.params = {b'\x00\x01': self.set_header_table_size,
-                       b'\x00\x02': self.set_enable_push,
-                       b'\x00\x03': self.set_max_concurrent_streams,
-                       b'\x00\x04': self.set_initial_window_size,
-                       b'\x00\x05': self.set_max_frame_size,
-                       }
-
-        payload = BytesIO(data)
-        while True:
-            identifier = payload.read(2)
-            if len(identifier) != 2:
-                break
-
-            value = payload.read(4)
-            if len(value) != 4:
-                break
-            try:
-                self.params[identifier](value)
-            except KeyError:
-                logger.error('unknown identifier: {}, {}'.format(identifier,
-                    int.from_bytes(value, 'big', signed=False)))
-
-    def set_header_table_size(self, value):
-        self.header_table_size = int.from_bytes(value, 'big', signed=False)
-        logger.debug('header_table_size: {}'.format(self.header_table_size))
-
-    def set_enable_push(self, value):
-        self.enable_push = int.from_bytes(value, 'big', signed=False)
-        logger.debug('enable_push: {}'.format(self.enable_push))
-
-    def set_initial_window_size(self, value):
-        self.initial_window_size = int.from_bytes(value, 'big', signed=False)
-        logger.debug('initial_window_size: {}'.format(self.initial_window_size))
-
-    def set_max_concurrent_streams(self, value):
-        self.max_concurrent_streams = int.from_bytes(value, 'big', signed=False)
-        logger.debug('max_concurrent_streams: {}'.format(self.max_concurrent_streams))
-
-    def set_max_frame_size(self, value):
-        self.max_frame_size = int.from_bytes(value, 'big', signed=False)
-        logger.debug('max_frame_size: {}'.format(self.max_frame_size))
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+        if data and (len(data) % 6 or self.ack):
+            raise FrameSizeError('SETTINGS frame of {} bytes'.format(len(data)))
+        if data:
+            for identifier, value in _setting.iter_unpack(data):
+                name = _setting_names.get(identifier)
+                # RFC 7540 6.5.2: unknown parameters must be ignored
+                if name:
+                    setattr(self, name, value)
+
+    @property
+    def ack(self):
+        return self.flags & 0x1
+
+    def parameters(self):
+        """ Returns a dict of the parameters in this frame. """
+        return {k: getattr(self, k) for k in self.__slots__ if getattr(self, k) is not None}
 
     def save(self):
-        base = super().save()
-        # TODO: enable to alter settings parameters
-        return base
+        payload = b''.join(_setting.pack(k, getattr(self, v)) for k, v in _setting_names.items()
+                           if getattr(self, v) is not None)
+        self.length = len(payload)
+        return super().save() + payload
 
     @staticmethod
     def FrameType():
@@ -137,22 +168,21 @@ class SettingFrame(FrameBase):
 
 
 class WindowUpdate(FrameBase):
-    """docstring for WindowUpdate"""
+    """ WINDOW_UPDATE frame. """
+    __slots__ = ('window_size',)
+
     def __init__(self, length: int, type_, flags: bytes, stream_identifier: int, data=None):
         super(WindowUpdate, self).__init__(length, type_, flags, stream_identifier)
-        logger.debug('WindowUpdate is called.')
-
-        payload = BytesIO(data)
+        check_length(self, data, 4)
         self.set_window_size(data)
 
     def set_window_size(self, value):
-        self.window_size = int.from_bytes(value, 'big', signed=False)
-        logger.debug('window_size: {}'.format(self.window_size))
-        
+        # the first bit is reserved
+        self.window_size = _uint32.unpack_from(value)[0] & 0x7fffffff
+
     def save(self):
-        base = super(WindowUpdate, self).save()
-        # TODO: enable to alter settings parameters
-        return base
+        self.length = 4
+        return super(WindowUpdate, self).save() + _uint32.pack(self.window_size)
 
     @staticmethod
     def FrameType():
@@ -165,82 +195,153 @@ class HeadersFlags(Enum):
     PRIORITY = 0x20
 
 
-class Headers(FrameBase, dict):
+class Headers(FrameBase, MutableMapping):
+    """ HEADERS frame, a mapping of the header fields. The header block is compressed with
+    HPACK, whose state is shared by all frames of a connection. Hence decode() must be called
+    with the decoder of the connection in the order the frames are received, and encoder must
+    be set to the encoder of the connection before save() is called in the order the frames
+    are sent. A header block larger than max_frame_size is sent with CONTINUATION frames.
+    """
+    __slots__ = ('fields', 'encoder', 'max_frame_size', 'end_stream', 'end_headers',
+                 'padded', 'priority', 'exclusive', 'stream_dependency', 'priority_weight',
+                 'header_block')
 
     def __init__(self, length: int, type_, flags: bytes, stream_identifier: int, data=None):
         super(Headers, self).__init__(length, type_, flags, stream_identifier)
-        logger.debug('Headers is called.')
-        self.end_stream = HeadersFlags.END_STREAM.value & self.flags
-        self.end_headers = HeadersFlags.END_HEADERS.value & self.flags
-        self.padded = HeadersFlags.PADDED.value & self.flags
-        self.priority = HeadersFlags.PRIORITY.value & self.flags
-        logger.debug('{}, {}, {}, {}'.format(self.end_stream,
-                                             self.end_headers,
-                                             self.padded,
-                                             self.priority))
-
-        payload = BytesIO(data)
+        self.fields = {}
+        self.encoder = None
+        self.max_frame_size = 16384
+        self.end_stream = HeadersFlags.END_STREAM.value & flags
+        self.end_headers = HeadersFlags.END_HEADERS.value & flags
+        self.padded = HeadersFlags.PADDED.value & flags
+        self.priority = HeadersFlags.PRIORITY.value & flags
+
+        check_length(self, data, (1 if self.padded else 0) + (5 if self.priority else 0), exact=False)
+        if not data:
+            self.header_block = b''
+            return
 
+        start, end = 0, len(data)
         if self.padded:
-            payload.read(1)
+            start = 1
+            end -= data[0]
 
-        if self.priority: # TODO: handle priority properly
-            self.stream_dependency = int.from_bytes(payload.read(4), 'big', signed=False)
-            self.priority_weight = int.from_bytes(payload.read(1), 'big', signed=False)
-            logger.debug('stream_dependency: {}, '.format(self.stream_dependency) +\
-                         'priority_weight: {}'.format(self.priority_weight))
+        if self.priority:
+            dependency, weight = _priority.unpack_from(data, start)
+            self.exclusive = bool(dependency >> 31)
+            self.stream_dependency = dependency & 0x7fffffff
+            self.priority_weight = weight + 1
+            start += 5
 
-        if length:
-            decoder = Decoder()
-            fields = decoder.decode(payload.read())
-            for k, v in fields:
-                self[k] = v
-                logger.debug('{}: {}'.format(k, v))
+        self.header_block = bytes(data[start:end])
 
-    def save(self):
+    def __getitem__(self, key):
+        return self.fields[key]
 
-        encoder = Encoder()
-        payload = encoder.encode(self)
-        self.length = len(payload)
+    def __setitem__(self, key, value):
+        self.fields[key] = value
 
-        decoder = Decoder()
-        check = decoder.decode(payload)
-        logger.info('payload of the header is {}'.format(check))
+    def __delitem__(self, key):
+        del self.fields[key]
 
-        base = super().save()
-        return base + payload
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def decode(self, decoder):
+        """ Decode the header block with the HPACK decoder of the connection. """
+        if self.header_block:
+            self.fields.update(decoder.decode(self.header_block))
+        return self
+
+    def save(self):
+        """ Returns this frame followed by CONTINUATION frames
+        when the header block is larger than max_frame_size.
+        """
+        encoder = self.encoder or Encoder()
+        payload = encoder.encode(self.fields)
+        if len(payload) <= self.max_frame_size:
+            self.length = len(payload)
+            return super().save() + payload
+
+        end_headers = self.flags & HeadersFlags.END_HEADERS.value
+        self.flags &= ~HeadersFlags.END_HEADERS.value
+        self.length = self.max_frame_size
+        res = [super().save(), payload[:self.max_frame_size]]
+
+        for i in range(self.max_frame_size, len(payload), self.max_frame_size):
+            fragment = payload[i:i + self.max_frame_size]
+            last = i + self.max_frame_size >= len(payload)
+            res.append(pack_header(len(fragment), FrameTypes.CONTINUATION.value,
+                                   end_headers if last else 0x0, self.stream_identifier))
+            res.append(fragment)
+        self.flags |= end_headers
+        return b''.join(res)
+
+    def append(self, continuation):
+        """ Append the header block fragment of a CONTINUATION frame. """
+        self.header_block += continuation.header_block
+        if continuation.end_headers:
+            self.end_headers = HeadersFlags.END_HEADERS.value
+            self.flags |= HeadersFlags.END_HEADERS.value
 
     @staticmethod
     def FrameType():
         return FrameTypes.HEADERS
 
 
+class Continuation(FrameBase):
+    """ CONTINUATION frame, which carries the rest of a header block. """
+    __slots__ = ('end_headers', 'header_block')
+
+    def __init__(self, length: int, type_, flags: int, stream_identifier: int, data=None):
+        super().__init__(length, type_, flags, stream_identifier)
+        self.end_headers = HeadersFlags.END_HEADERS.value & flags
+        self.header_block = bytes(data) if data else b''
+
+    def save(self):
+        self.length = len(self.header_block)
+        return super().save() + self.header_block
+
+    @staticmethod
+    def FrameType():
+        return FrameTypes.CONTINUATION
+
+
 class GoAway(FrameBase):
+    """ GOAWAY frame. """
+    __slots__ = ('last_stream_id', 'error_code', 'append_data')
+
     def __init__(self, length: int, type_, flags: int, stream_identifier: int, data=None):
         super().__init__(length, type_, flags, stream_identifier)
-        logger.debug('GoAway is called.')
+        check_length(self, data, _goaway.size, exact=False)
+        last_stream_id, self.error_code = _goaway.unpack_from(data)
+        self.last_stream_id = last_stream_id & 0x7fffffff
+        self.append_data = bytes(data[_goaway.size:])
 
-        payload = BytesIO(data)
-        self.stream_identifier = int.from_bytes(payload.read(4), 'big', signed=False)
-        self.error_code = int.from_bytes(payload.read(4), 'big', signed=False)
-        self.append_data = payload.read()
-        logger.debug('stream_identifier: {}'.format(self.stream_identifier))
-        logger.debug('error_code: {}'.format(self.error_code))
-        logger.debug('append_data: {}'.format(self.append_data))
+    def save(self):
+        payload = _goaway.pack(self.last_stream_id, self.error_code) + self.append_data
+        self.length = len(payload)
+        return super().save() + payload
 
     @staticmethod
     def FrameType():
         return FrameTypes.GOAWAY
 
 class RstStream(FrameBase):
+    """ RST_STREAM frame. """
+    __slots__ = ('error_code',)
+
     def __init__(self, length: int, type_, flags: int, stream_identifier: int, data=None):
         super().__init__(length, type_, flags, stream_identifier)
-        logger.debug('RstStream is called.')
-        if len(data) != 4:
-            raise Exception('Frame size error')
+        check_length(self, data, 4)
+        self.error_code = _uint32.unpack_from(data)[0]
 
-        self.error_code = int.from_bytes(data, 'big', signed=False)
-        logger.debug('error_code: {}'.format(self.error_code))
+    def save(self):
+        self.length = 4
+        return super().save() + _uint32.pack(self.error_code)
 
     @staticmethod
     def FrameType():
@@ -253,30 +354,28 @@ class DataFlags(Enum):
     PADDED = 0x8
 
 class Data(FrameBase):
-    """docstring for Data"""
+    """ DATA frame. data is the payload without padding, which is a memoryview
+    of the received bytes when the frame is parsed by FrameBase.load.
+    """
+    __slots__ = ('end_stream', 'padded', 'data')
+
     def __init__(self, length: int, type_, flags: int, stream_identifier: int, data=None):
         super().__init__(length, type_, flags, stream_identifier)
-        logger.debug('Data is called.')
-        self.end_stream = DataFlags.END_STREAM.value & self.flags
-        self.padded = DataFlags.PADDED.value & self.flags
+        self.end_stream = DataFlags.END_STREAM.value & flags
+        self.padded = DataFlags.PADDED.value & flags
 
-        payload = BytesIO(data)
-
-        if self.padded:
-            pad_length = int.from_bytes(payload.read(1), 'big', signed=False)
+        if not data:
+            self.data = b''
+        elif self.padded:
             # TODO: add checking logic of pad_length.
-            data_length = length - pad_length - 1
+            self.data = data[1:length - data[0]]
         else:
-            data_length = length
-
-        self.data = payload.read(data_length)
+            self.data = data
 
     def save(self):
-        base = super().save()
-        logger.info(base)
-        logger.info('payload size of the data is {}'.format(len(self.data)))
-        logger.info(self.data)
-        return base + self.data
+        self.length = len(self.data)
+        self.flags &= ~DataFlags.PADDED.value # padding is not sent
+        return super().save() + self.data
 
     @staticmethod
     def FrameType():
@@ -284,23 +383,21 @@ class Data(FrameBase):
 
 
 class Priority(FrameBase):
+    """ PRIORITY frame. """
+    __slots__ = ('exclusive', 'dependent_stream', 'weight')
+
     def __init__(self, length: int, type_, flags: int, stream_identifier: int, data=None):
         super().__init__(length, type_, flags, stream_identifier)
-        logger.debug('Priority is called.')
-
-        payload = BytesIO(data)
-
-        self.dependent_stream = int.from_bytes(payload.read(4), 'big', signed=False)
-        self.weight = int.from_bytes(payload.read(1), 'big', signed=False)
+        check_length(self, data, _priority.size)
+        dependency, weight = _priority.unpack_from(data)
+        self.exclusive = bool(dependency >> 31)
+        self.dependent_stream = dependency & 0x7fffffff
+        self.weight = weight + 1 # 1 to 256
 
     def save(self):
-        base = super().save()
-
-        payload = self.dependent_stream.to_bytes(4, 'big', signed=False) +\
-               self.weight.to_bytes(1, 'big', signed=False)
         self.length = 5
-
-        return base + payload
+        return super().save() + _priority.pack(self.dependent_stream | self.exclusive << 31,
+                                                self.weight - 1)
 
     @staticmethod
     def FrameType():
@@ -309,11 +406,175 @@ class Priority(FrameBase):
 
 
 class Stream(object):
-    def __init__(self, parent, weight, window_size=None):
+    """ A node of the dependency tree of a connection (RFC 7540 5.3).
+    frames are the DATA frames of this stream waiting to be written, queued is
+    the number of frames waiting in the subtree of this node.
+    """
+    __slots__ = ('identifier', 'parent', 'weight', 'children', 'frames', 'queued',
+                 'pass_', 'vtime', 'closed')
+
+    def __init__(self, identifier, parent=None, weight=16):
+        self.identifier = identifier
         self.parent = parent
         self.weight = weight
-        if window_size:
-            self.window_size = window_size
-
-    def __setattr__(self, key, value):
-        pass
+        self.children = []
+        self.frames = deque()
+        self.queued = 0
+        self.pass_ = 0 # virtual time when this stream is scheduled next by its parent
+        self.vtime = 0 # virtual time of the children of this stream
+        self.closed = False
+        if parent is not None:
+            parent.children.append(self)
+
+    def is_ancestor_of(self, stream):
+        while stream is not None:
+            stream = stream.parent
+            if stream is self:
+                return True
+        return False
+
+    def move_to(self, parent):
+        """ Make this stream (and its subtree) depend on parent. """
+        queued = self.queued
+        if queued:
+            self.parent.add_queued(-queued)
+        self.parent.children.remove(self)
+        self.parent = parent
+        parent.children.append(self)
+        if queued:
+            self.pass_ = max(self.pass_, parent.vtime)
+            parent.add_queued(queued)
+
+    def add_queued(self, n):
+        stream = self
+        while stream is not None:
+            stream.queued += n
+            stream = stream.parent
+
+    def __repr__(self):
+        return 'Stream({}, weight={})'.format(self.identifier, self.weight)
+
+
+class Scheduler(object):
+    """ Output scheduler of the DATA frames of a connection. It keeps the dependency
+    tree of the streams given by HEADERS and PRIORITY frames. pop() returns a frame
+    of a stream whose ancestors have no frames to send, and shares the connection
+    among sibling streams in proportion to their weights (stride scheduling by the
+    number of bytes). Streams of the same virtual time are taken in the order of
+    their identifiers, so that the order of frames is deterministic.
+    """
+    def __init__(self):
+        self.root = Stream(0, weight=256)
+        self.streams = {0: self.root}
+
+    def __len__(self):
+        return self.root.queued
+
+    def __contains__(self, stream_identifier):
+        return stream_identifier in self.streams
+
+    def add(self, stream_identifier, depends_on=0, weight=16, exclusive=False):
+        """ Add a stream to the tree. A dependency on an unknown stream
+        is replaced by the default priority (RFC 7540 5.3.1).
+        """
+        if stream_identifier in self.streams:
+            return self.prioritize(stream_identifier, depends_on, weight, exclusive)
+        parent = self.streams.get(depends_on, self.root)
+        stream = Stream(stream_identifier, weight=weight)
+        self.streams[stream_identifier] = stream
+        self.attach(stream, parent, exclusive)
+        return stream
+
+    def prioritize(self, stream_identifier, depends_on=0, weight=16, exclusive=False):
+        """ Change the priority of a stream (RFC 7540 5.3.3). """
+        if stream_identifier == depends_on:
+            raise ValueError('stream {} depends on itself'.format(stream_identifier))
+        stream = self.streams.get(stream_identifier)
+        if stream is None:
+            return self.add(stream_identifier, depends_on, weight, exclusive)
+
+        parent = self.streams.get(depends_on, self.root)
+        if stream.is_ancestor_of(parent):
+            # the new parent is moved to the former parent of the stream first
+            parent.move_to(stream.parent)
+        stream.weight = weight
+        stream.move_to(parent)
+        if exclusive:
+            for child in list(parent.children):
+                if child is not stream:
+                    child.move_to(stream)
+        return stream
+
+    def attach(self, stream, parent, exclusive):
+        stream.parent = parent
+        if exclusive:
+            for child in list(parent.children):
+                child.move_to(stream)
+        parent.children.append(stream)
+
+    def close(self, stream_identifier):
+        """ Remove a stream after its frames are popped. """
+        stream = self.streams.get(stream_identifier)
+        if stream is None:
+            return
+        stream.closed = True
+        if not stream.frames:
+            self.remove(stream)
+
+    def reset(self, stream_identifier):
+        """ Drop the frames of a stream and remove it. """
+        stream = self.streams.get(stream_identifier)
+        if stream is None:
+            return
+        stream.add_queued(-len(stream.frames))
+        stream.frames.clear()
+        self.close(stream_identifier)
+
+    def remove(self, stream):
+        """ Remove a stream from the tree, its children inherit its weight (RFC 7540 5.3.4). """
+        del self.streams[stream.identifier]
+        parent = stream.parent
+        total = sum(x.weight for x in stream.children)
+        for child in list(stream.children):
+            child.weight = max(1, stream.weight * child.weight // total)
+            child.move_to(parent)
+        parent.children.remove(stream)
+        stream.parent = None
+
+    def push(self, stream_identifier, frame):
+        """ Queue a DATA frame of a stream. """
+        stream = self.streams.get(stream_identifier)
+        if stream is None:
+            stream = self.add(stream_identifier)
+        if not stream.queued:
+            stream.pass_ = max(stream.pass_, stream.parent.vtime)
+        stream.frames.append(frame)
+        stream.add_queued(1)
+
+    def pending(self, stream_identifier):
+        """ The number of frames of a stream waiting to be popped. """
+        stream = self.streams.get(stream_identifier)
+        return len(stream.frames) if stream else 0
+
+    def pop(self):
+        """ Returns the next frame to be written or None when no frame is queued. """
+        if not self.root.queued:
+            return None
+
+        path = []
+        stream = self.root
+        while not stream.frames:
+            parent = stream
+            stream = min((x for x in parent.children if x.queued),
+                         key=lambda x: (x.pass_, x.identifier))
+            parent.vtime = stream.pass_
+            path.append(stream)
+
+        frame = stream.frames.popleft()
+        stream.add_queued(-1)
+        cost = max(frame.length, 1) * 256
+        for x in path:
+            x.pass_ += cost / x.weight
+        if stream.closed and not stream.frames:
+            self.remove(stream)
+        return frame
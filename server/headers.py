@@ -0,0 +1,136 @@
+import time
+import asyncio
+from http import HTTPStatus
+
+# private programs
+from .util import IMFFixdate
+from .logger import get_logger_set
+logger, log = get_logger_set('headers')
+
+
+# status lines of every status code, e.g. b'HTTP/1.1 200 OK\r\n'
+STATUS_LINES = {x.value: 'HTTP/1.1 {} {}\r\n'.format(x.value, x.phrase).encode('latin-1')
+                for x in HTTPStatus}
+
+CONNECTION_KEEP_ALIVE = b'Connection: keep-alive\r\n'
+CONNECTION_CLOSE = b'Connection: close\r\n'
+TRANSFER_ENCODING_CHUNKED = b'Transfer-Encoding: chunked\r\n'
+
+DEFAULT_FIELDS = {'Server': 'SimpleServer',
+                  'Content-Type': 'text/html;charset=utf-8',
+                  }
+
+
+def etag_matches(if_none_match, *etags):
+    """ Returns True if the value of If-None-Match matches one of etags
+    by the weak comparison (RFC 7232 2.3.2, 3.2).
+    """
+    if not if_none_match:
+        return False
+    tags = [x.strip() for x in if_none_match.split(',')]
+    if '*' in tags:
+        return True
+    tags = {x[2:] if x.startswith('W/') else x for x in tags}
+    return any((x[2:] if x.startswith('W/') else x) in tags for x in etags if x)
+
+
+def serialize(fields):
+    """ Serialize a dict of header fields to bytes. """
+    return ''.join('{}: {}\r\n'.format(k, v) for k, v in fields.items()).encode('latin-1')
+
+
+class HeaderBlock(object):
+    """ Header fields which are serialized once, e.g. the default
+    headers of a route. They are built when the route is registered.
+    """
+    __slots__ = ('fields', 'data')
+
+    def __init__(self, fields):
+        self.fields = dict(fields)
+        self.data = serialize(self.fields)
+
+    def merge(self, fields):
+        """ Returns the serialized fields of this block overridden by fields. """
+        if not fields:
+            return self.data
+        merged = dict(self.fields)
+        merged.update(fields)
+        return serialize(merged)
+
+
+DEFAULT_BLOCK = HeaderBlock(DEFAULT_FIELDS)
+
+
+class DateCache(object):
+    """ Keeps the value of Date header. It is refreshed once per second by
+    a timer of the event loop after start() is called. Before that, the value
+    is computed on every access.
+    """
+    def __init__(self):
+        self.handle = None
+        self.refresh()
+
+    def start(self, loop=None):
+        loop = loop or asyncio.get_running_loop()
+        if self.handle and self.loop is loop:
+            return
+        self.stop()
+        self.loop = loop
+        self.refresh()
+        self.schedule()
+
+    def stop(self):
+        if self.handle:
+            self.handle.cancel()
+            self.handle = None
+
+    def schedule(self):
+        # fire just after the next second begins
+        now = time.time()
+        self.handle = self.loop.call_later(1.0 - now % 1.0, self.tick)
+
+    def tick(self):
+        self.refresh()
+        self.schedule()
+
+    def refresh(self):
+        self._value = time.strftime(IMFFixdate, time.gmtime())
+        self._field = 'Date: {}\r\n'.format(self._value).encode('latin-1')
+
+    @property
+    def value(self):
+        if not self.handle:
+            self.refresh()
+        return self._value
+
+    @property
+    def field(self):
+        """ The Date header field as bytes. """
+        if not self.handle:
+            self.refresh()
+        return self._field
+
+
+date_cache = DateCache()
+
+
+def make_head(status, block=DEFAULT_BLOCK, fields=None, length=None,
+              chunked=False, keep_alive=True, cookie=None):
+    """ Returns the status line and the header section of a response as bytes.
+    block is the HeaderBlock of the route, fields are headers given by the route
+    function, which override block. Content-Length is sent when length is not None.
+    """
+    res = [STATUS_LINES[status], date_cache.field, block.merge(fields)]
+
+    if length is not None:
+        res.append(b'Content-Length: %d\r\n' % length)
+    elif chunked:
+        res.append(TRANSFER_ENCODING_CHUNKED)
+
+    res.append(CONNECTION_KEEP_ALIVE if keep_alive else CONNECTION_CLOSE)
+
+    if cookie:
+        res.append(cookie.output().encode('latin-1') + b'\r\n')
+
+    res.append(b'\r\n')
+    return b''.join(res)
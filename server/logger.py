@@ -1,21 +1,47 @@
+import time
 from functools import wraps
+from inspect import iscoroutinefunction
 from logging import getLogger, NullHandler, Formatter, DEBUG
 from copy import copy
 
 
 def get_logger_set(name=None):
-    """ Returns a pair of logger and its decorator. """
+    """ Returns a pair of logger and its decorator.
+    The decorator logs calls of a function with its arguments and the elapsed time
+    at DEBUG level. It returns the function itself when DEBUG is disabled at the time of
+    decoration, so set the level of the logger before the modules are imported to trace calls.
+    """
     if name:
         logger = getLogger('simpleLedger').getChild(name)
     else:
         logger = getLogger('simpleLedger')
 
     def _log(fn):
-        @wraps(fn)
-        def wrapper(*args, **kwds):
-            logger.debug('{}({}, {})'.format(fn.__name__, args, kwds))
-            res = fn(*args, **kwds)
-            return res
+        if not logger.isEnabledFor(DEBUG):
+            return fn
+
+        if iscoroutinefunction(fn):
+            @wraps(fn)
+            async def wrapper(*args, **kwds):
+                if not logger.isEnabledFor(DEBUG):
+                    return await fn(*args, **kwds)
+                logger.debug('{}({}, {})'.format(fn.__qualname__, args, kwds))
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwds)
+                finally:
+                    logger.debug('{} took {:.3f} ms'.format(fn.__qualname__, (time.perf_counter() - start) * 1e3))
+        else:
+            @wraps(fn)
+            def wrapper(*args, **kwds):
+                if not logger.isEnabledFor(DEBUG):
+                    return fn(*args, **kwds)
+                logger.debug('{}({}, {})'.format(fn.__qualname__, args, kwds))
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwds)
+                finally:
+                    logger.debug('{} took {:.3f} ms'.format(fn.__qualname__, (time.perf_counter() - start) * 1e3))
         return wrapper
     return logger, _log
 
@@ -2,15 +2,22 @@ import http
 import re
 import sys
 import io
+import mmap
+import time
+import asyncio
+import tempfile
 from http.cookies import SimpleCookie
 from collections import defaultdict
+from logging import DEBUG
 
 # private source
-from .util import serializable, MessageType, HeaderFields
+from .util import serializable, MessageType, HeaderFields, TransferCodings
 from .logger import get_logger_set
 logger, log = get_logger_set('message')
 
 class BaseHTTPError(Exception):
+    headers = {} # header fields sent with the error response
+
     def get_message(self):
         if not self.status:
             raise NotImplementedException()
@@ -29,6 +36,9 @@ class NotFound(BaseHTTPError):
 class URITooLong(BaseHTTPError):
     status = http.HTTPStatus.REQUEST_URI_TOO_LONG
 
+class RequestTimeout(BaseHTTPError):
+    status = http.HTTPStatus.REQUEST_TIMEOUT
+
 class RequestEntityTooLarge(BaseHTTPError):
     status = http.HTTPStatus.REQUEST_ENTITY_TOO_LARGE
 
@@ -41,6 +51,19 @@ class MethodNotAllowed(BaseHTTPError):
 class NotImplementedError(BaseHTTPError):
     status = http.HTTPStatus.NOT_IMPLEMENTED
 
+class ServiceUnavailable(BaseHTTPError):
+    status = http.HTTPStatus.SERVICE_UNAVAILABLE
+
+    def __init__(self, retry_after=None):
+        super(ServiceUnavailable, self).__init__()
+        if retry_after is not None:
+            self.headers = {'Retry-After': str(retry_after)}
+
+class Shed(ServiceUnavailable):
+    """ A request which is refused before it is processed, e.g. by admission control.
+    The client may retry it, even if it is not idempotent.
+    """
+
 class MediaType(serializable):
     re = r'(\S+?)/(\S+?) ?; ?(\S+?=\S+)'
 
@@ -105,9 +128,9 @@ class Header(serializable):
 
 
 class Headers(dict, serializable):
-    def __init__(self, *, headers=[], cookie=SimpleCookie(), **kwds, ):
+    def __init__(self, *, headers=[], cookie=None, **kwds, ):
         super(dict, self).__init__()
-        self.cookie = cookie
+        self.cookie = cookie if cookie is not None else SimpleCookie()
         [self.set_header(header) for header in headers]
 
     def set_cookie(self, key, value):
@@ -175,6 +198,196 @@ class ResponseBody(serializable):
         return self.data
         
 
+class StreamingBody(serializable):
+    """ Response body of unknown length. source is an iterable or an async iterable
+    of str or bytes-like chunks. Iterating over it (async for) yields the chunks
+    as bytes-like objects as soon as the source produces them.
+    """
+    def __init__(self, source):
+        super(StreamingBody, self).__init__()
+        self.source = source
+
+    async def __aiter__(self):
+        if hasattr(self.source, '__aiter__'):
+            async for data in self.source:
+                if isinstance(data, str):
+                    data = data.encode('utf-8')
+                if data:
+                    yield data
+        else:
+            for data in self.source:
+                if isinstance(data, str):
+                    data = data.encode('utf-8')
+                if data:
+                    yield data
+
+
+class FileBody(StreamingBody):
+    """ Response body which is a part of a file. count bytes from offset are sent.
+    Iterating over it yields chunks read through a memory map of the file.
+    """
+    def __init__(self, path, offset, count, chunk_size=65536):
+        super(FileBody, self).__init__(None)
+        self.path = path
+        self.offset = offset
+        self.count = count
+        self.chunk_size = chunk_size
+
+    async def __aiter__(self):
+        if not self.count:
+            return
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            end = self.offset + self.count
+            for i in range(self.offset, end, self.chunk_size):
+                yield m[i:min(i + self.chunk_size, end)]
+
+
+class RequestStream(object):
+    """ Request body as an async byte stream, read by await body.read(n) or
+    async for chunk in body. length is the value of Content-Length or None.
+
+    The protocol handler feeds the stream by feed() and feed_eof(). fill is an optional
+    coroutine function called with the stream when its buffer is empty; it reads
+    more of the body and feeds it. consumed is an optional coroutine function called
+    with the number of bytes read, which the HTTP/2 handler uses to open the flow-control
+    window of the stream. read() raises RequestEntityTooLarge when more than max_size
+    bytes are received.
+
+    timer is a timer.Timer which is set while read() waits for data, so that the body
+    is received at least at min_rate bytes per second after timeout seconds of grace.
+    The owner of the timer makes read() fail when it expires, e.g. by timed_out().
+    """
+    def __init__(self, length=None, *, max_size=None, fill=None, consumed=None, chunk_size=65536,
+                 timer=None, timeout=None, min_rate=None):
+        self.length = length
+        self.max_size = max_size
+        self.fill = fill
+        self.consumed = consumed
+        self.chunk_size = chunk_size
+        # read deadline, see time_left()
+        self.timer = timer
+        self.timeout = timeout
+        self.min_rate = min_rate
+        self.waited = 0.0 # seconds read() has waited for data
+        self.buffer = bytearray()
+        self.size = 0 # bytes received
+        self.eof = False
+        self.exception = None
+        self.waiter = None
+        self.file = None # SpooledTemporaryFile of the body after spool()
+
+    def limit(self, max_size):
+        """ Set max_size. Raises RequestEntityTooLarge if the body is already known to be larger. """
+        self.max_size = max_size
+        if max_size is not None and max(self.length or 0, self.size) > max_size:
+            raise RequestEntityTooLarge()
+
+    def feed(self, data):
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            self.set_exception(RequestEntityTooLarge())
+            return
+        self.buffer += data
+        self._wakeup()
+
+    def feed_eof(self):
+        self.eof = True
+        self._wakeup()
+
+    def set_exception(self, exception):
+        self.exception = exception
+        self._wakeup()
+
+    def timed_out(self):
+        self.set_exception(RequestTimeout())
+
+    def time_left(self):
+        """ Seconds read() can wait for data: timeout plus the time to receive
+        the bytes so far at min_rate, less the time it has already waited.
+        """
+        allowed = self.timeout + (self.size / self.min_rate if self.min_rate else 0.0)
+        return max(0.0, allowed - self.waited)
+
+    def _wakeup(self):
+        waiter, self.waiter = self.waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def read(self, n=-1):
+        """ Read at most n bytes, or all the rest of the body if n is negative.
+        Returns b'' at the end of the body.
+        """
+        if n < 0:
+            chunks = []
+            while True:
+                data = await self.read(self.chunk_size)
+                if not data:
+                    return b''.join(chunks)
+                chunks.append(data)
+
+        if self.file is not None:
+            return self.file.read(n)
+
+        while not self.buffer and not self.eof and self.exception is None:
+            timed = self.timer is not None and self.timeout is not None
+            if timed:
+                self.timer.set(self.time_left())
+                start = time.monotonic()
+            try:
+                if self.fill is not None:
+                    await self.fill(self)
+                else:
+                    self.waiter = asyncio.get_running_loop().create_future()
+                    await self.waiter
+            finally:
+                if timed:
+                    self.timer.cancel()
+                    self.waited += time.monotonic() - start
+        if self.exception is not None:
+            raise self.exception
+
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        if data and self.consumed is not None:
+            await self.consumed(len(data))
+        return data
+
+    async def __aiter__(self):
+        while True:
+            data = await self.read(self.chunk_size)
+            if not data:
+                return
+            yield data
+
+    async def spool(self, max_size):
+        """ Receive the whole body into a SpooledTemporaryFile, which keeps up to
+        max_size bytes in memory and the rest on disk. Later reads come from the file.
+        """
+        file = tempfile.SpooledTemporaryFile(max_size=max_size)
+        try:
+            async for data in self:
+                file.write(data)
+        except BaseException:
+            file.close()
+            raise
+        file.seek(0)
+        self.file = file
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        self.buffer = bytearray()
+
+
+LAST_CHUNK = b'0\r\n\r\n'
+# chunk-size = 1*HEXDIG (RFC 7230 4.1), at most 16 digits
+_CHUNK_SIZE = re.compile(rb'[0-9a-fA-F]{1,16}')
+
+def encode_chunk(data):
+    """ Encode data as a chunk of chunked transfer-coding (RFC 7230 4.1). """
+    return b'%x\r\n%b\r\n' % (len(data), data)
+
+
 class RequestBody(serializable):
     """docstring for RequestBody"""
     re = r'[\r\n]*(.+?)=([^&\?]+)&?'
@@ -197,7 +410,8 @@ class RequestBody(serializable):
             tb = sys.exc_info()[2]
             raise BadRequest().with_traceback(tb)
 
-        logger.debug('RequestBody.load({})'.format(parsed))
+        if logger.isEnabledFor(DEBUG):
+            logger.debug('RequestBody.load({})'.format(parsed))
         return cls(parsed)
         
     def save(self):
@@ -235,6 +449,8 @@ class RequestBodyJson(serializable):
 
 
 class HTTPMessage(serializable):
+    close = False # the connection must be closed after this message, e.g. its framing is ambiguous
+
     def __init__(self, start_line=None, headers={}, body=None):
         super(HTTPMessage, self).__init__()
         self.start_line = start_line
@@ -282,6 +498,191 @@ class HTTPMessage(serializable):
 
         return res
 
+class RequestParser(object):
+    """ Incremental parser of HTTP/1.1 requests working on bytes.
+    feed() the data as it arrives, then take the head of a request with head()
+    and decode its body with read_body(). Bytes after a completed request stay
+    in the buffer, so pipelined requests are parsed in order.
+    A request-line longer than max_request_line raises URITooLong, more than max_headers
+    header fields raise BadRequest and a head larger than max_header_size raises
+    RequestEntityTooLarge.
+    """
+    def __init__(self, data=b'', *, max_request_line=8192, max_headers=100, max_header_size=65536):
+        self.max_request_line = max_request_line
+        self.max_headers = max_headers
+        self.max_header_size = max_header_size
+        self.buffer = bytearray(data)
+        self.request = None # a request whose body is not received yet
+        self.length = 0 # length of the body of self.request
+        self.chunked = False # the body of self.request is sent with chunked transfer-coding
+        self.chunk_size = None # remaining size of the current chunk, None while reading a chunk-size line
+        self.trailer = False # the last chunk is received, reading the trailer part
+        self.body = bytearray() # decoded chunks
+        self.scanned = 0 # the position where the next search of the end of headers starts
+
+    def feed(self, data):
+        """ Append data to the buffer. """
+        self.buffer += data
+
+    def head(self):
+        """ Parse the head of the next request. Returns the request, or None if more data
+        is needed. When the request has a body, read_body() must decode it until it is
+        completed before the head of the next request is parsed.
+        """
+        if not self.parse_head():
+            return None
+        request = self.request
+        if not self.chunked and not self.length:
+            self.request = None
+        return request
+
+    def read_body(self):
+        """ Decode the body of the current request from the buffer. Returns a pair
+        of the decoded bytes and True when the body is completed.
+        """
+        if self.chunked:
+            done = self.parse_chunks()
+            data = bytes(self.body)
+            self.body = bytearray()
+        else:
+            data = bytes(self.buffer[:self.length])
+            del self.buffer[:self.length]
+            self.length -= len(data)
+            done = not self.length
+
+        if done:
+            self.request = None
+            self.chunked = False
+            self.chunk_size = None
+        return data, done
+
+    def parse_head(self):
+        # RFC 7230 3.5: ignore empty lines received prior to the request-line
+        while self.buffer[:2] == b'\r\n':
+            del self.buffer[:2]
+
+        end = self.buffer.find(b'\r\n\r\n', self.scanned)
+        if end < 0:
+            if len(self.buffer) > self.max_request_line \
+                and self.buffer.find(b'\r\n', 0, self.max_request_line + 2) < 0:
+                raise URITooLong()
+            if len(self.buffer) > self.max_header_size:
+                raise RequestEntityTooLarge()
+            self.scanned = max(0, len(self.buffer) - 3)
+            return False
+        if end > self.max_header_size:
+            raise RequestEntityTooLarge()
+
+        lines = bytes(self.buffer[:end]).split(b'\r\n')
+        del self.buffer[:end + 4]
+        self.scanned = 0
+        if len(lines[0]) > self.max_request_line:
+            raise URITooLong()
+        if len(lines) - 1 > self.max_headers:
+            raise BadRequest()
+
+        try:
+            method, uri, version = lines[0].decode('ascii').split(' ')
+        except (UnicodeDecodeError, ValueError):
+            raise BadRequest()
+
+        headers = Headers()
+        length = None
+        chunked = False
+        for line in lines[1:]:
+            key, sep, value = line.partition(b':')
+            if not sep or not key or key[-1:].isspace():
+                raise BadRequest()
+            # field names are case-insensitive, they are stored in the same case as HTTP/2 ones
+            key = key.decode('latin-1').title()
+            value = value.strip(b' \t').decode('latin-1') # OWS (RFC 7230 3.2)
+            if key == 'Content-Length':
+                # RFC 7230 3.3.2: 1*DIGIT, repeated values must be the same
+                values = {x.strip(' \t') for x in value.split(',')}
+                if len(values) != 1:
+                    raise BadRequest()
+                value_ = values.pop()
+                if not (value_.isascii() and value_.isdigit()):
+                    raise BadRequest()
+                if length is not None and int(value_) != length:
+                    raise BadRequest()
+                length = int(value_)
+            elif key == 'Transfer-Encoding':
+                codings = [x.strip().lower() for x in value.split(',')]
+                if codings != [TransferCodings.CHUNKED.value]:
+                    raise NotImplementedError()
+                chunked = True
+            headers.set_header(Header(key, value))
+
+        self.request = HTTPMessage(RequestLine(method, uri, version), headers)
+        # RFC 7230 3.3.3: Transfer-Encoding overrides Content-Length,
+        # and the connection is closed after the response (RFC 9112 6.1)
+        if chunked and length is not None:
+            self.request.close = True
+        self.chunked = chunked
+        self.length = 0 if chunked or length is None else length
+        return True
+
+    def parse_chunks(self):
+        """ Decode chunked transfer-coding in the buffer into self.body.
+        A part of a chunk is decoded as soon as it is received.
+        Returns True when the last chunk and the trailer part are received.
+        """
+        while True:
+            if self.trailer:
+                # discard the trailer part, it ends with an empty line
+                while True:
+                    end = self.buffer.find(b'\r\n')
+                    if end < 0:
+                        return False
+                    del self.buffer[:end + 2]
+                    if end == 0:
+                        self.trailer = False
+                        return True
+
+            if self.chunk_size is None:
+                end = self.buffer.find(b'\r\n')
+                if end < 0:
+                    return False
+                size, ext, _ = bytes(self.buffer[:end]).partition(b';')
+                if ext:
+                    size = size.rstrip(b' \t') # BWS before chunk-ext
+                if not _CHUNK_SIZE.fullmatch(size):
+                    raise BadRequest()
+                self.chunk_size = int(size, 16)
+                del self.buffer[:end + 2]
+                if self.chunk_size == 0:
+                    self.trailer = True
+                    continue
+
+            if self.chunk_size:
+                size = min(self.chunk_size, len(self.buffer))
+                self.body += self.buffer[:size]
+                del self.buffer[:size]
+                self.chunk_size -= size
+                if self.chunk_size:
+                    return False
+
+            # CRLF after chunk-data
+            if len(self.buffer) < 2:
+                return False
+            if self.buffer[:2] != b'\r\n':
+                raise BadRequest()
+            del self.buffer[:2]
+            self.chunk_size = None
+
+    @staticmethod
+    def load_body(headers, data):
+        content_type = headers.get(HeaderFields.CONTENT_TYPE.value)
+        if content_type:
+            content_type = content_type.split(';')[0].strip()
+        try:
+            return _bodyClass[(MessageType.REQUEST, content_type)].load(data.decode('utf-8'))
+        except Exception as e:
+            logger.warning(e)
+            raise BadRequest()
+
+
 _bodyClass = {
     (MessageType.REQUEST, None): RequestBody,
     (MessageType.REQUEST, 'application/json'): RequestBodyJson,
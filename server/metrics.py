@@ -0,0 +1,173 @@
+from bisect import bisect_left
+from http import HTTPStatus
+
+# private programs
+from . import message
+from .logger import get_logger_set
+logger, log = get_logger_set('metrics')
+
+
+# upper bounds of the buckets of latency histograms in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = ['{}="{}"'.format(k, _escape(v)) for k, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric(object):
+    """ Base class of metrics. A metric has a value per tuple of label values.
+    Metrics are updated by the thread of the event loop without locks.
+    """
+    type_ = None
+
+    def __init__(self, name, help_, labels=()):
+        self.name = name
+        self.help = help_
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def expose(self):
+        """ Returns the metric in Prometheus text exposition format as a list of lines. """
+        res = ['# HELP {} {}'.format(self.name, self.help),
+               '# TYPE {} {}'.format(self.name, self.type_)]
+        for k, v in sorted(self.values.items(), key=lambda x: tuple(map(str, x[0]))):
+            res.append('{}{} {}'.format(self.name, _format_labels(self.labels, k), v))
+        return res
+
+
+class Counter(Metric):
+    type_ = 'counter'
+
+    def inc(self, labels=(), value=1):
+        values = self.values
+        values[labels] = values.get(labels, 0) + value
+
+
+class Gauge(Metric):
+    type_ = 'gauge'
+
+    def inc(self, labels=(), value=1):
+        values = self.values
+        values[labels] = values.get(labels, 0) + value
+
+    def dec(self, labels=(), value=1):
+        self.inc(labels, -value)
+
+    def set(self, value, labels=()):
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    """ Histogram of fixed buckets. An observation increments one bucket,
+    the cumulative counts are computed by expose().
+    """
+    type_ = 'histogram'
+
+    def __init__(self, name, help_, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help_, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        try:
+            counts = self.values[labels]
+        except KeyError:
+            counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def expose(self):
+        res = ['# HELP {} {}'.format(self.name, self.help),
+               '# TYPE {} {}'.format(self.name, self.type_)]
+        for k, counts in sorted(self.values.items(), key=lambda x: tuple(map(str, x[0]))):
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                total += count
+                res.append('{}_bucket{} {}'.format(
+                    self.name, _format_labels(self.labels, k, 'le="{}"'.format(bound)), total))
+            res.append('{}_sum{} {}'.format(self.name, _format_labels(self.labels, k), counts[-1]))
+            res.append('{}_count{} {}'.format(self.name, _format_labels(self.labels, k), total))
+        return res
+
+
+class Registry(object):
+    """ A set of metrics. Each worker process of a prefork server has its own registry. """
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError('metric {} is already registered'.format(metric.name))
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_, labels=()):
+        return self.register(Counter(name, help_, labels))
+
+    def gauge(self, name, help_, labels=()):
+        return self.register(Gauge(name, help_, labels))
+
+    def histogram(self, name, help_, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_, labels, buckets))
+
+    def expose(self):
+        """ Returns all metrics in Prometheus text exposition format. """
+        res = []
+        for metric in self.metrics.values():
+            res.extend(metric.expose())
+        res.append('')
+        return '\n'.join(res)
+
+
+registry = Registry()
+
+connections = registry.counter('http_connections_total', 'Connections accepted.', ('protocol',))
+active_connections = registry.gauge('http_connections_active', 'Connections being served.', ('protocol',))
+requests = registry.counter('http_requests_total', 'Requests handled.', ('protocol', 'method', 'route', 'status'))
+request_duration = registry.histogram('http_request_duration_seconds', 'Time to handle a request.', ('route',))
+errors = registry.counter('http_errors_total', 'Errors by protocol and kind.', ('protocol', 'error'))
+bytes_received = registry.counter('http_bytes_received_total', 'Bytes read from clients.', ('protocol',))
+bytes_sent = registry.counter('http_bytes_sent_total', 'Bytes written to clients.', ('protocol',))
+frames = registry.counter('http2_frames_total', 'HTTP/2 frames by direction and type.', ('direction', 'type'))
+requests_in_flight = registry.gauge('http_requests_in_flight', 'Requests admitted and being handled.')
+requests_queued = registry.gauge('http_requests_queued', 'Requests waiting for admission.')
+queue_duration = registry.histogram('http_request_queue_seconds', 'Time requests waited for admission.', ('priority',))
+shed = registry.counter('http_shed_total', 'Connections and requests refused by admission control.',
+                        ('protocol', 'reason'))
+executor_pending = registry.gauge('http_executor_pending', 'Route calls submitted to an executor and not finished.',
+                                  ('executor',))
+executor_queued = registry.gauge('http_executor_queued', 'Route calls waiting for a worker of an executor.',
+                                 ('executor',))
+executor_rejected = registry.counter('http_executor_rejected_total', 'Route calls refused by a full executor.',
+                                     ('executor',))
+
+
+# methods counted by their names, others are counted as 'other',
+# so that clients cannot create any number of time series
+METHODS = frozenset(('GET', 'HEAD', 'POST', 'PUT', 'DELETE', 'PATCH', 'OPTIONS', 'CONNECT', 'TRACE'))
+
+
+def record_request(protocol, method, route, status, seconds):
+    """ Count a request and observe its latency. route is the path of the route, '' when no route matches. """
+    requests.inc((protocol, method if method in METHODS else 'other', route, int(status)))
+    request_duration.observe(seconds, (route,))
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def endpoint():
+    """ Route function which exposes the metrics of the default registry, e.g.
+    server.route('GET', '/metrics')(metrics.endpoint)
+    """
+    headers = message.Headers(headers=[message.Header('Content-Type', CONTENT_TYPE),
+                                       message.Header('Cache-Control', 'no-cache')])
+    return message.HTTPMessage(message.StatusLine('HTTP/1.1', HTTPStatus.OK), headers,
+                               message.ResponseBody(registry.expose()))
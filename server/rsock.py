@@ -5,7 +5,15 @@ from operator import itemgetter, attrgetter
 from .logger import get_logger_set
 logger, log = get_logger_set('socket')
 
-def create_socket(address):
+def create_socket(address, *, backlog=128, reuse_port=False, nodelay=True, defer_accept=None):
+    """ Create a listening socket.
+    backlog is the length of the queue of pending connections.
+    reuse_port sets SO_REUSEPORT, so that several processes can bind the same port
+    and the kernel balances connections between them.
+    nodelay sets TCP_NODELAY, which accepted sockets inherit.
+    defer_accept is the number of seconds for TCP_DEFER_ACCEPT (Linux), a connection
+    is not accepted until the client sends data.
+    """
     host, port = address
     rsock = None
     info = socket.getaddrinfo(host, port, socket.AF_UNSPEC,
@@ -22,8 +30,15 @@ def create_socket(address):
             rsock = None
             continue
         try:
+            rsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuse_port:
+                rsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            if nodelay:
+                rsock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if defer_accept and hasattr(socket, 'TCP_DEFER_ACCEPT'):
+                rsock.setsockopt(socket.IPPROTO_TCP, socket.TCP_DEFER_ACCEPT, defer_accept)
             rsock.bind(sa)
-            rsock.listen(1)
+            rsock.listen(backlog)
         except OSError as msg:
             logger.error(msg)
             rsock.close()
@@ -31,4 +46,3 @@ def create_socket(address):
             continue
         break
     return rsock
-
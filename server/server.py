@@ -1,19 +1,31 @@
 from functools import wraps
-from inspect import signature, iscoroutine
+from inspect import iscoroutine
+import time
 import asyncio
 import ssl
+import socket
 import sys
 from http import HTTPStatus
-from datetime import timezone, datetime
+from http.cookies import SimpleCookie
 from enum import Enum, auto
+from collections import deque, OrderedDict
 # from urllib.parse import urlparse, parse_qs
 
 # private library
 # from .message import *
 from . import message
 from . import util
+from . import metrics
 from .rsock import create_socket
-from .frame import FrameBase, FrameTypes, SettingFrame, HeadersFlags, DataFlags
+from .supervisor import Supervisor, start_heartbeat
+from .headers import make_head, date_cache, DEFAULT_BLOCK, STATUS_LINES
+from .timer import timers
+from .compression import Compressor, encoded_etag
+from .admission import Admission
+from .executor import Offload
+from hpack import Encoder, Decoder, HPACKError
+from .frame import FrameBase, FrameTypes, SettingFrame, HeadersFlags, DataFlags, ErrorCodes, Scheduler
+from .frame import FRAME_HEADER_SIZE, FrameSizeError, unpack_header
 
 from .logger import get_logger_set
 logger, log = get_logger_set('server')
@@ -23,17 +35,168 @@ class HandlerTypes(Enum):
     HTTP1_1 = auto()
     HTTP2 = auto()
         
+def stop_reading(reader, writer):
+    """ Make the pending and later reads of reader return EOF, e.g. when a read deadline passes. """
+    writer.transport.pause_reading()
+    reader.feed_eof()
+
+
 class HandlerBase(object):
-    def __init__(self, router, reader, writer):
+    """ max_body_size is the limit of a request body which is read in memory and parsed.
+    max_stream_size is the limit of a body streamed to a route registered with stream=True,
+    None for no limit. When spool_size is set, a streamed body is received into a
+    SpooledTemporaryFile (spool_size bytes in memory, the rest on disk) before the route
+    function is called. Larger bodies are answered with 413.
+
+    Slow clients are limited by read deadlines: the head of a request must be received
+    within header_timeout seconds after its first byte, and a body at min_body_rate
+    bytes per second after body_timeout seconds of grace. Deadlines are timers of
+    timer.timers. max_request_line, max_headers and max_header_size limit the head.
+
+    Requests are handled within slots of admission, an admission.Admission shared
+    by the connections of a server. refused is True when the connection is over
+    max_connections of admission: only requests of CRITICAL routes are handled on it.
+    Synchronous route functions run in the executors of offload, an executor.Offload,
+    as their routes declare. They run in the event loop when offload is None.
+    """
+    def __init__(self, router, reader, writer, compressor=None, *,
+                 max_body_size=1 << 20, max_stream_size=None, spool_size=None,
+                 header_timeout=10.0, body_timeout=10.0, min_body_rate=1024,
+                 max_request_line=8192, max_headers=100, max_header_size=65536,
+                 admission=None, refused=False, offload=None):
         self.router = router
         self.reader = reader
         self.writer = writer
+        self.compressor = compressor # compression.Compressor, None disables compression
+        self.max_body_size = max_body_size
+        self.max_stream_size = max_stream_size
+        self.spool_size = spool_size
+        self.header_timeout = header_timeout
+        self.body_timeout = body_timeout
+        self.min_body_rate = min_body_rate
+        self.max_request_line = max_request_line
+        self.max_headers = max_headers
+        self.max_header_size = max_header_size
+        self.admission = admission or Admission()
+        self.refused = refused
+        self.offload = offload
+        self.timer = timers.timer(self.read_timed_out) # read deadline of the connection
+        self.expired = False # a read deadline has passed
+
+    def read_timed_out(self):
+        self.expired = True
+        stop_reading(self.reader, self.writer)
 
     async def handle_request(self, path):
         """ Handles HTTP request method. Call an appropriate function from path and method."""
         raise NotImplementedException()
 
 
+    async def call_with_args(self, plan, request, path_params={}):
+        """ If request body has some key-value pair and the route function requires
+        the same arguments, this function call the function with arguments
+        supplied in the body. Path parameters captured by the router
+        are supplied in the same way and take precedence over the body.
+        plan is the util.CallPlan of the function.
+        """
+        params = {}
+        if plan.parameters:
+            # delete undeclared parameters
+            if request and request.body and not plan.stream:
+                params = {k:v for k, v in request.body.data.items() if k in plan.parameters}
+            for k, v in path_params.items():
+                if k in plan.parameters:
+                    params[k] = v
+
+        if plan.wants_request:
+            params['request'] = request
+
+        if plan.is_coroutine:
+            return await plan.fn(**params)
+
+        kind = self.offload.kind(plan) if self.offload is not None else None
+        if kind is not None:
+            res = await self.offload.run(kind, plan, params)
+        else:
+            res = plan.fn(**params)
+        if iscoroutine(res):
+            return await res
+        else:
+            return res
+
+    async def compress(self, accept_encoding, status, headers, block, data):
+        """ Compress the body of a response if the client accepts it.
+        headers are the header fields given by the route function and block is
+        the HeaderBlock of the route. Returns a pair of the body and a dict of
+        header fields to be added to the response, which may be None.
+        """
+        if self.compressor is None or status != HTTPStatus.OK \
+            or 'Content-Encoding' in headers or 'Content-Encoding' in block.fields:
+            return data, None
+        content_type = headers.get('Content-Type') or block.fields.get('Content-Type')
+        if not self.compressor.compressible(content_type, data):
+            return data, None
+
+        coding = self.compressor.negotiate(accept_encoding)
+        if coding is None:
+            return data, {'Vary': 'Accept-Encoding'}
+        etag = headers.get('ETag') or block.fields.get('ETag')
+        data = await self.compressor.compress(data, coding, etag)
+        fields = {'Content-Encoding': coding, 'Vary': 'Accept-Encoding'}
+        if etag:
+            fields['ETag'] = encoded_etag(etag, coding)
+        return data, fields
+
+    async def prepare_body(self, plan, request, body):
+        """ Set request.body from body, the message.RequestStream of the request.
+        A route registered with stream=True gets the stream itself, spooled if
+        spool_size is set. The body is read in memory and parsed for other routes.
+        """
+        if plan.stream:
+            body.limit(self.max_stream_size)
+            if self.spool_size is not None:
+                await body.spool(self.spool_size)
+            request.body = body
+        else:
+            body.limit(self.max_body_size)
+            data = await body.read()
+            request.body = message.RequestParser.load_body(request.headers, data) if data else None
+
+    async def call_cached(self, plan, request, path_params={}):
+        """ Call the route function through plan.cache, a cache.ResponseCache.
+        Returns a pair of a cache.CacheEntry and the result of the route function,
+        one of which is None. A fresh entry is returned without calling the function,
+        the entry of 304 if If-None-Match of request matches it.
+        """
+        cache = plan.cache
+        block = plan.headers or DEFAULT_BLOCK
+        res = None
+
+        async def create():
+            nonlocal res
+            res = await self.call_with_args(plan, request, path_params)
+            if isinstance(res, message.HTTPMessage):
+                return cache.make_entry(res.start_line.code, res.headers, res.body, block)
+            return cache.make_entry(HTTPStatus.OK, {}, self.make_body(res), block)
+
+        entry = await cache.fetch(cache.make_key(request.start_line.uri, request.headers), create)
+        if entry is None:
+            if res is None: # the response to a concurrent request could not be cached
+                res = await self.call_with_args(plan, request, path_params)
+            return None, res
+        if entry.matches(request.headers.get('If-None-Match')):
+            entry = entry.not_modified()
+        return entry, None
+
+    @staticmethod
+    def make_body(data):
+        """ Make a response body from the result of a route function. str and bytes-like
+        objects are sent as they are, other (async) iterables are streamed chunk by chunk.
+        """
+        if isinstance(data, (str, bytes, bytearray, memoryview)):
+            return message.ResponseBody.load(data)
+        return message.StreamingBody(data)
+
     @classmethod
     def find_handler(cls, handler_type):
         handlers = {klass.handler_type(): klass for klass in cls.__subclasses__()}
@@ -45,178 +208,950 @@ class HandlerBase(object):
 
 
 class HTTP1_1Handler(HandlerBase):
-    def __init__(self, router, reader, writer):
-        super(HTTP1_1Handler, self).__init__(router, reader, writer)
+    """ Serves HTTP/1.1 requests on a persistent connection.
+    data is the bytes which were already read from reader (e.g. while checking
+    the HTTP/2 connection preface). Pipelined requests are handled one by one,
+    so that their responses are written back in the order of the requests.
+    """
+    def __init__(self, router, reader, writer, data=b'', *,
+                 keep_alive_timeout=5.0, max_requests=100, compressor=None, **kwds):
+        super(HTTP1_1Handler, self).__init__(router, reader, writer, compressor, **kwds)
+        self.parser = message.RequestParser(data, max_request_line=self.max_request_line,
+                                            max_headers=self.max_headers,
+                                            max_header_size=self.max_header_size)
+        self.keep_alive_timeout = keep_alive_timeout
+        self.max_requests = max_requests
+        self.expect_continue = False # 100 Continue is not sent yet for the current request
+        self.head_sent = False # the head of the response to the current request is written
 
     @staticmethod
     def handler_type():
         return HandlerTypes.HTTP1_1
 
-    @log
-    async def parse(self, data):
-        """ Parse HTTP/1.1 request """
-        text = data.decode('utf-8')
-        request = message.HTTPMessage.load(text)
+    async def run(self):
+        """ Handle requests until the client closes the connection, asks to close it,
+        keeps it idle longer than keep_alive_timeout or sends max_requests requests.
+        """
+        count = 0
+        while True:
+            try:
+                request = await self.read_request()
+            except message.BaseHTTPError as e:
+                logger.warning(e)
+                metrics.errors.inc(('http/1.1', str(e.status.value)))
+                self.write_error(e, self.writer, keep_alive=False)
+                await self.writer.drain()
+                break
+
+            if request is None:
+                if self.expired and self.parser.buffer: # a part of a request is received
+                    metrics.errors.inc(('http/1.1', 'timeout'))
+                    self.write_error(message.RequestTimeout(), self.writer, keep_alive=False)
+                    await self.writer.drain()
+                elif self.expired:
+                    logger.debug('keep-alive timeout')
+                break
+
+            count += 1
+            keep_alive = self.keep_alive(request) and count < self.max_requests
+            keep_alive = await self.handle_request(request, keep_alive)
+            if not keep_alive:
+                break
+
+    async def read_request(self):
+        """ Read bytes from reader until the head of a request is completed.
+        Its body is read by fill_body() while the request is handled.
+        The connection may be idle for keep_alive_timeout seconds, then the head
+        must be completed within header_timeout seconds after its first byte.
+        Returns None when the connection is closed before the head is completed.
+        """
+        request = self.parser.head()
+        if request is not None:
+            return request
+        started = bool(self.parser.buffer)
+        self.timer.set(self.header_timeout if started else self.keep_alive_timeout)
+        try:
+            while request is None:
+                data = await self.reader.read(65536)
+                if not data:
+                    return None
+                if not started: # the first bytes of a request
+                    started = True
+                    self.timer.set(self.header_timeout)
+                metrics.bytes_received.inc(('http/1.1',), len(data))
+                self.parser.feed(data)
+                request = self.parser.head()
+        finally:
+            self.timer.cancel()
         return request
 
-    def make_headers(self):
-        x = [message.Header('Date', datetime.now(tz=timezone.utc).strftime(util.IMFFixdate)),
-             message.Header('Server', 'SimpleServer'),
-             message.Header('Content-Type', 'text/html;charset=utf-8'),
-            ]
-        return message.Headers(headers=x)
+    def request_body(self, request):
+        """ Returns a message.RequestStream of the body of request, or None if it has no body. """
+        if self.parser.request is not request:
+            return None
+        self.expect_continue = request.headers.get('Expect', '').lower() == '100-continue'
+        return message.RequestStream(None if self.parser.chunked else self.parser.length,
+                                     fill=self.fill_body, timer=self.timer,
+                                     timeout=self.body_timeout, min_rate=self.min_body_rate)
+
+    async def fill_body(self, body):
+        """ Read a part of the body of the current request and feed it to body. """
+        data, done = self.parser.read_body()
+        while not data and not done:
+            if self.expect_continue:
+                self.expect_continue = False
+                self.write(STATUS_LINES[HTTPStatus.CONTINUE] + b'\r\n')
+            chunk = await self.reader.read(65536)
+            if not chunk:
+                body.set_exception(message.RequestTimeout() if self.expired else message.BadRequest())
+                return
+            metrics.bytes_received.inc(('http/1.1',), len(chunk))
+            self.parser.feed(chunk)
+            data, done = self.parser.read_body()
+        if data:
+            body.feed(data)
+        if done:
+            body.feed_eof()
 
+    async def discard_body(self, body):
+        """ Read and discard the rest of the body of the current request, so that
+        the next request can be read. Returns False if the connection must be closed instead.
+        """
+        if self.expect_continue: # the client may not send the body
+            return False
+        if (body.length or 0) - body.size > self.max_body_size:
+            return False
+        size = 0
+        try:
+            while self.parser.request is not None:
+                size += len(await body.read(65536))
+                if size > self.max_body_size:
+                    return False
+        except message.BaseHTTPError:
+            return False
+        return True
+
+    @staticmethod
+    def keep_alive(request):
+        """ Returns True if the connection can be reused after this request. """
+        if request.close:
+            return False
+        connection = request.headers.get('Connection', '').lower()
+        if request.start_line.version == 'HTTP/1.0':
+            return 'keep-alive' in connection
+        return 'close' not in connection
 
-    def write_error(self, exception, writer):
-        status = message.StatusLine('HTTP/1.1', exception.status)
-        headers = self.make_headers()
-        msg = exception.get_message()
+    def make_response(self, data):
+        status = message.StatusLine('HTTP/1.1', HTTPStatus.OK)
+        body = self.make_body(data)
+        return message.HTTPMessage(start_line=status, body=body)
+
+    async def send_file(self, body):
+        """ Write a FileBody. Plaintext connections use loop.sendfile, which copies
+        the file in the kernel. TLS connections have to encrypt the data in user space,
+        so the file is written chunk by chunk from a memory map.
+        """
+        if self.writer.get_extra_info('sslcontext'):
+            async for data in body:
+                self.write(data)
+                await self.writer.drain()
+        elif body.count:
+            metrics.bytes_sent.inc(('http/1.1',), body.count)
+            await self.writer.drain()
+            with open(body.path, 'rb') as f:
+                loop = asyncio.get_running_loop()
+                await loop.sendfile(self.writer.transport, f, body.offset, body.count)
+
+    def write(self, data):
+        self.writer.write(data)
+        metrics.bytes_sent.inc(('http/1.1',), len(data))
+
+    def write_error(self, exception, writer, keep_alive=True):
+        msg = exception.get_message().encode('utf-8')
         logger.debug(msg)
-        body = message.ResponseBody(msg)
-        result = message.HTTPMessage(status, headers, body).save()
-        writer.write(result.encode('utf-8'))
+        data = make_head(exception.status, fields=exception.headers, length=len(msg),
+                         keep_alive=keep_alive) + msg
+        writer.write(data)
+        metrics.bytes_sent.inc(('http/1.1',), len(data))
 
 
-    @log
-    async def handle_request(self, request):
-        """ Handle request and write the result to writer """
-        try:
-            fn, methods = self.router.find(request.start_line.uri)
-            if request.start_line.method not in methods:
-                raise message.MethodNotAllowed()
+    def fail(self, exception, keep_alive):
+        """ Write the error response of exception. Returns False if the connection must be closed.
+        When the head of a response is already written (e.g. a streamed body fails),
+        the response is aborted instead: the connection is closed without completing it,
+        so that the client sees it is incomplete.
+        """
+        if self.head_sent:
+            logger.warning('the response is aborted: {!r}'.format(exception))
+            return False
+        self.write_error(exception, self.writer, keep_alive)
+        return keep_alive
 
-            if request.body:
-                response = await self.call_with_args(fn, request)
-            else:
-                response = await self.call_with_args(fn, None)
+    async def send_response(self, request, plan, response, keep_alive):
+        """ Write the response of a route function. Returns a pair of the status
+        and False if the connection must be closed after the response.
+        """
+        if not isinstance(response, message.HTTPMessage):
+            response = self.make_response(response)
 
-            logger.debug(response)
-            logger.debug(response.save())
+        # append cookie
+        cookie = request.headers.cookie
+        if getattr(response.headers, 'cookie', None):
+            cookie = SimpleCookie(cookie)
+            cookie.update(response.headers.cookie)
 
-            if isinstance(response, str):
-                response = self.make_response(response)
+        status = response.start_line.code
+        block = plan.headers or DEFAULT_BLOCK
+        fields = response.headers
+        body, length, chunked = None, None, False
+        if status in (HTTPStatus.NO_CONTENT, HTTPStatus.NOT_MODIFIED):
+            response.body = None
+        elif isinstance(response.body, message.FileBody):
+            length = response.body.count
+        elif isinstance(response.body, message.StreamingBody):
+            # the length is unknown, use chunked transfer-coding if the client accepts it
+            chunked = request.start_line.version != 'HTTP/1.0'
+            if not chunked:
+                keep_alive = False
+        else:
+            body = response.body.save() if response.body else b''
+            if isinstance(body, str):
+                body = body.encode('utf-8')
+            body, extra = await self.compress(request.headers.get('Accept-Encoding'),
+                                              status, fields, block, body)
+            if extra:
+                fields = {**fields, **extra}
+            length = len(body)
 
-            # append cookie
-            headers = self.make_headers()
-            for k, v in request.headers.cookie.items():
-                if k not in headers.cookie:
-                    headers.set_cookie(k, v)
+        # headers given by the route function override the default ones of the route
+        self.write(make_head(status, block, fields, length, chunked, keep_alive, cookie))
+        self.head_sent = True
+        if request.start_line.method == 'HEAD' or response.body is None:
+            pass
+        elif isinstance(response.body, message.FileBody):
+            await self.send_file(response.body)
+        elif body is None:
+            async for data in response.body:
+                self.write(message.encode_chunk(data) if chunked else data)
+                await self.writer.drain()
+            if chunked:
+                self.write(message.LAST_CHUNK)
+        else:
+            self.write(body)
+        return status, keep_alive
 
-            # append Content-Length header
-            length = len(response.body.save().encode('utf-8'))
-            headers.set_header(message.Header('Content-Length', length))
+    async def send_entry(self, request, entry, keep_alive):
+        """ Write a cache.CacheEntry, whose header fields are already serialized. Returns the status. """
+        body, fields = await self.compress(request.headers.get('Accept-Encoding'),
+                                           entry.status, {}, entry.block, entry.body)
+        length = len(body) if entry.status != HTTPStatus.NOT_MODIFIED else None
+        self.write(make_head(entry.status, entry.block, fields, length, False, keep_alive,
+                             request.headers.cookie))
+        self.head_sent = True
+        if request.start_line.method != 'HEAD' and body:
+            self.write(body)
+        return entry.status
 
-            response.headers = headers
+    @log
+    async def handle_request(self, request, keep_alive=True):
+        """ Handle request and write the result to writer.
+        Returns False if the connection must be closed after the response.
+        """
+        start = time.perf_counter()
+        route = ''
+        body = self.request_body(request)
+        self.head_sent = False
+        try:
+            plan, methods, path_params = self.router.find(request.start_line.uri)
+            route = plan.route
+            if request.start_line.method not in methods:
+                raise message.MethodNotAllowed()
+            if self.refused and plan.priority < util.Priority.CRITICAL:
+                raise self.admission.error()
+
+            async with self.admission.admit(plan.priority, 'http/1.1'):
+                if body is not None:
+                    await self.prepare_body(plan, request, body)
 
-            self.writer.write(response.save().encode('utf-8'))
+                if plan.cache is not None and request.start_line.method in ('GET', 'HEAD'):
+                    entry, response = await self.call_cached(plan, request, path_params)
+                else:
+                    entry, response = None, await self.call_with_args(plan, request, path_params)
+
+                if entry is not None:
+                    status = await self.send_entry(request, entry, keep_alive)
+                else:
+                    status, keep_alive = await self.send_response(request, plan, response, keep_alive)
 
         except KeyError as e:
             logger.warning(e)
-            self.write_error(message.NotFound().with_traceback(sys.exc_info()[2]), self.writer)
+            e = message.NotFound().with_traceback(sys.exc_info()[2])
+            status = e.status
+            keep_alive = self.fail(e, keep_alive)
         except TypeError as e:
             logger.warning(e)
             e = message.InternalServerError().with_traceback(sys.exc_info()[2])
-            self.write_error(e, self.writer)
+            status = e.status
+            keep_alive = self.fail(e, keep_alive)
         except message.BaseHTTPError as e:
             e = e.with_traceback(sys.exc_info()[2])
             logger.warning(e)
-            self.write_error(e, self.writer)
-
-        await self.writer.drain()
+            status = e.status
+            if isinstance(e, (message.RequestEntityTooLarge, message.RequestTimeout)):
+                keep_alive = False # the rest of the body is not read
+            keep_alive = self.fail(e, keep_alive)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(e)
+            metrics.errors.inc(('http/1.1', type(e).__name__))
+            e = message.InternalServerError().with_traceback(sys.exc_info()[2])
+            status = e.status
+            keep_alive = self.fail(e, False)
 
-    async def call_with_args(self, fn, request):
-        """ If request body has some key-value pair and fn requires
-        the same arguments, this function call the fn with arguments
-        supplied in the body.
-        """
+        if body is not None:
+            if keep_alive and self.parser.request is not None:
+                keep_alive = await self.discard_body(body)
+            body.close()
 
-        sig = signature(fn)
-        # delete undeclared parameters
-        if request:
-            params = {k:v for k, v in request.body.data.items() if k in sig.parameters}
-        else:
-            params = {}
+        await self.writer.drain()
+        metrics.record_request('http/1.1', request.start_line.method, route, status,
+                               time.perf_counter() - start)
+        if status >= 400:
+            metrics.errors.inc(('http/1.1', str(int(status))))
+        return keep_alive
 
-        if 'request' in sig.parameters.keys():
-            bn = sig.bind_partial(request=request, **params)
-        else:
-            bn = sig.bind_partial(**params)
+class HTTP2Handler(HandlerBase):
+    """ Serves HTTP/2 connection. Each request (HEADERS frame) is handled in its own task
+    while frames are read, so that streams are multiplexed. At most max_concurrent_streams
+    requests are handled at the same time. Frames are written by a single writer task.
+    Control frames are written first in order, then DATA frames are taken from
+    frame.Scheduler, which shares the connection among streams by their priority.
 
-        res = fn(*bn.args, **bn.kwargs)
+    DATA frames are sent within the flow-control windows of the client. A stream
+    whose window (or the window of the connection) is exhausted waits for WINDOW_UPDATE
+    in its own task. Received DATA frames are acknowledged by WINDOW_UPDATE when half
+    of a window of the server is consumed: the window of the connection as DATA frames
+    are received, the window of a stream as its request body is read, so that a route
+    function which reads slowly holds back only its own client.
 
-        if iscoroutine(res):
-            return await res
-        else:
-            return res
+    settings are the SETTINGS parameters advertised to the client, a dict whose keys
+    are the lower case names of frame.SettingParameters. They override default_settings.
+    window_size is the flow-control window of the connection, which is not changed
+    by SETTINGS. A SETTINGS frame which is not acknowledged within settings_timeout
+    seconds closes the connection.
+    """
+    default_settings = {'header_table_size': 4096,
+                        'max_concurrent_streams': 100,
+                        'initial_window_size': 65535,
+                        'max_frame_size': 16384,
+                        }
+    window_size = 65535
+    settings_timeout = 10.0
+    max_pending_frames = 4 # DATA frames of a stream queued to the scheduler
+    write_batch_size = 65536 # bytes written by one writelines()
+    high_water = 65536 # the size of the write buffer to wait for drain()
 
-class HTTP2Handler(HandlerBase):
-    """docstring for HTTP2Server"""
-    def __init__(self, router, reader, writer):
-        super(HTTP2Handler, self).__init__(router, reader, writer)
+    def __init__(self, router, reader, writer, *, settings=None, window_size=None, compressor=None,
+                 keep_alive_timeout=5.0, **kwds):
+        super(HTTP2Handler, self).__init__(router, reader, writer, compressor, **kwds)
+        self.settings = dict(self.default_settings, **(settings or {}))
+        self.settings.setdefault('max_header_list_size', self.max_header_size)
+        self.keep_alive_timeout = keep_alive_timeout
+        if window_size is not None:
+            self.window_size = window_size
+        self.pending_settings = deque() # timers of SETTINGS frames waiting for ACK
+        self.pending_headers = None # HEADERS frame waiting for CONTINUATION frames
+        self.last_stream_id = 0
+        self.closed = False # GOAWAY has been sent
+        self.lost = False # the client has gone, nothing can be sent any more
+        # flow-control windows of the client
+        self.initial_window_size = 65535 # SETTINGS_INITIAL_WINDOW_SIZE of the client
+        self.client_window_size = 65535
         self.client_stream_window_size = {}
+        self.window_updated = asyncio.Condition()
+        # bytes received but not acknowledged by WINDOW_UPDATE yet
+        self.received = 0
+        self.stream_received = {}
+        self.max_frame_size = 16384 # SETTINGS_MAX_FRAME_SIZE of the client
+        self.streams = {} # stream identifier -> task handling the stream
+        self.bodies = {} # stream identifier -> message.RequestStream receiving DATA frames
+        self.responding = set() # streams whose response HEADERS are sent
+        # frames to be written
+        self.control = deque() # frames other than DATA, None stops the writer
+        self.scheduler = Scheduler() # DATA frames
+        self.idle = OrderedDict() # idle streams added to the scheduler by PRIORITY frames
+        self.frame_queued = asyncio.Event()
+        self.frame_written = asyncio.Condition()
+        # HPACK contexts of the connection
+        self.encoder = Encoder()
+        self.decoder = Decoder()
+        self.decoder.max_allowed_table_size = self.settings['header_table_size']
+        if self.settings.get('max_header_list_size'):
+            self.decoder.max_header_list_size = self.settings['max_header_list_size']
 
     async def run(self):
-        frame = await self.parse_stream()
-        my_settings = FrameBase.create(FrameTypes.SETTINGS.value, 0x0, frame.stream_identifier)
-        await self.send_frame(my_settings)
-        await self.handle_frame(frame)
+        writer_task = asyncio.ensure_future(self.write_frames())
+        writer_task.add_done_callback(self.writer_done)
+        try:
+            frame = await self.parse_stream()
+            if frame is None:
+                return
+            await self.send_settings(self.settings)
+            if self.refused: # over max_connections, no stream is processed
+                await self.go_away(ErrorCodes.NO_ERROR)
+                await writer_task
+                return
+            if self.window_size > 65535: # the window of the connection is not changed by SETTINGS
+                await self.send_window_update(0, self.window_size - 65535)
+            await self.handle_frame(frame)
+
+            while not self.closed:
+                frame = await self.parse_stream()
+                if frame is None:
+                    break
+                await self.handle_frame(frame)
+
+            if not self.closed:
+                # the client has closed the connection, the responses cannot be completed
+                await self.connection_lost()
+                await self.send_frame(None)
+            await writer_task
+
+        finally:
+            writer_task.cancel()
+            for task in list(self.streams.values()):
+                task.cancel()
+            for timer in self.pending_settings:
+                timer.cancel()
+
+    def writer_done(self, task):
+        """ The writer task has stopped. If it failed, e.g. the connection is reset,
+        stop reading and give up the streams.
+        """
+        if task.cancelled() or task.exception() is None:
+            return
+        logger.warning(task.exception())
+        stop_reading(self.reader, self.writer)
+        asyncio.ensure_future(self.connection_lost())
 
+    async def connection_lost(self):
+        """ Cancel the streams and wake up the tasks waiting for flow-control windows
+        or for frames to be written, which will never happen.
+        """
+        if self.lost:
+            return
+        self.lost = True
+        for task in list(self.streams.values()):
+            task.cancel()
+        async with self.window_updated:
+            self.window_updated.notify_all()
+        async with self.frame_written:
+            self.frame_written.notify_all()
 
+    async def write_frames(self):
+        """ The writer task. Writes control frames in order and DATA frames in the order
+        of the scheduler, until it gets None and the scheduler is empty. Frames queued
+        in the same iteration of the event loop are written by one writelines() call,
+        up to write_batch_size bytes. drain() is awaited only when the write buffer
+        of the transport is larger than high_water.
+        """
+        transport = self.writer.transport
+        stopping = False
         while True:
-            frame = await self.parse_stream()
-            if not frame:
-                break
-            await self.handle_frame(frame)
+            if not self.control and not self.scheduler:
+                if stopping:
+                    break
+                self.frame_queued.clear()
+                await self.frame_queued.wait()
+            # let the other tasks queue their frames before they are gathered
+            await asyncio.sleep(0)
 
-    async def parse_stream(self):
-        data = await self.reader.read(9)
-        if len(data) != 9:
+            batch = []
+            size = 0
+            has_data = False
+            while size < self.write_batch_size:
+                if self.control:
+                    frame = self.control.popleft()
+                    if frame is None:
+                        stopping = True
+                        continue
+                elif self.scheduler:
+                    frame = self.scheduler.pop()
+                    has_data = True
+                else:
+                    break
+                data = frame.save()
+                metrics.frames.inc(('sent', frame.FrameType().name))
+                batch.append(data)
+                size += len(data)
+
+            if batch:
+                self.writer.writelines(batch)
+                metrics.bytes_sent.inc(('h2',), size)
+            if has_data:
+                async with self.frame_written:
+                    self.frame_written.notify_all()
+            if transport.get_write_buffer_size() > self.high_water:
+                await self.writer.drain()
+        await self.writer.drain()
+
+    async def handle_stream(self, header, body=None):
+        """ Handle a request on a stream and write an error response if it fails.
+        body is the message.RequestStream of the request, None if it has no body.
+        """
+        start = time.perf_counter()
+        route = ''
+        try:
+            if len(header[':path']) > self.max_request_line:
+                raise message.URITooLong()
+            if len(header) > self.max_headers:
+                raise message.BadRequest()
+            plan, methods, path_params = self.router.find(header[':path'])
+            route = plan.route
+            async with self.admission.admit(plan.priority, 'h2'):
+                status = await self.handle_request(header, plan, methods, path_params, body)
+        except message.Shed as e:
+            # the request is not processed, the client may retry it (RFC 7540 8.1.4)
+            status = e.status
+            self.bodies.pop(header.stream_identifier, None)
+            await self.send_rst_stream(header.stream_identifier, ErrorCodes.REFUSED_STREAM)
+        except KeyError as e:
+            logger.warning(e)
+            e = message.NotFound()
+            status = e.status
+            await self.send_error(header.stream_identifier, e)
+        except message.BaseHTTPError as e:
+            logger.warning(e)
+            status = e.status
+            await self.send_error(header.stream_identifier, e)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(e)
+            status = HTTPStatus.INTERNAL_SERVER_ERROR
+            await self.abort_stream(header.stream_identifier)
+        finally:
+            if body is not None:
+                body.close()
+
+        if header.stream_identifier in self.bodies:
+            # RFC 7540 8.1: the response is complete before the request, stop the rest of the request
+            async with self.frame_written:
+                await self.frame_written.wait_for(
+                    lambda: self.lost or not self.scheduler.pending(header.stream_identifier))
+            await self.send_rst_stream(header.stream_identifier, ErrorCodes.NO_ERROR)
+
+        metrics.record_request('h2', header.get(':method'), route, status, time.perf_counter() - start)
+        if status >= 400:
+            metrics.errors.inc(('h2', str(int(status))))
+
+    async def abort_stream(self, stream_identifier, error_code=ErrorCodes.INTERNAL_ERROR):
+        """ Reset a stream whose response cannot be completed. Its queued DATA frames are dropped. """
+        self.bodies.pop(stream_identifier, None)
+        self.scheduler.reset(stream_identifier)
+        await self.send_rst_stream(stream_identifier, error_code)
+
+    async def send_error(self, stream_identifier, exception):
+        """ Send the error response of exception, or reset the stream
+        if the HEADERS of a response are already sent.
+        """
+        if stream_identifier in self.responding:
+            logger.warning('the response is aborted: {!r}'.format(exception))
+            await self.abort_stream(stream_identifier)
             return
-        payload = int.from_bytes(data[:3], 'big', signed=False)
-        data += await self.reader.read(payload)
-        return FrameBase.load(data)
-        
-    async def handle_request(self, header):
-        fn, methods = self.router.find(header[':path'])
+        msg = exception.get_message().encode('utf-8')
+        reply_header = self.create_headers(HeadersFlags.END_HEADERS.value, stream_identifier)
+        reply_header[':status'] = exception.status.value
+        reply_header['date'] = date_cache.value
+        for k, v in DEFAULT_BLOCK.fields.items():
+            reply_header[k.lower()] = v
+        for k, v in exception.headers.items():
+            reply_header[k.lower()] = v
+        await self.send_frame(reply_header)
+        await self.send_data(stream_identifier, msg, end_stream=True)
+
+    async def parse_stream(self):
+        """ Read the next frame. Returns None at the end of the connection.
+        Frames of unknown types are discarded (RFC 7540 4.1).
+        """
+        factory = FrameBase.get_factory()
+        while True:
+            # a connection without streams may be idle for keep_alive_timeout seconds,
+            # a frame and a header block must be completed within header_timeout seconds
+            if self.pending_headers is not None:
+                if not self.timer.active:
+                    self.timer.set(self.header_timeout)
+            elif self.streams:
+                self.timer.cancel()
+            else:
+                self.timer.set(self.keep_alive_timeout)
+            try:
+                header = await self.reader.readexactly(FRAME_HEADER_SIZE)
+                length, type_, flags, stream_identifier = unpack_header(header)
+                if length > self.settings['max_frame_size']:
+                    logger.warning('frame of {} bytes exceeds SETTINGS_MAX_FRAME_SIZE'.format(length))
+                    await self.go_away(ErrorCodes.FRAME_SIZE_ERROR)
+                    return
+                if self.pending_headers is None:
+                    self.timer.set(self.header_timeout)
+                payload = await self.reader.readexactly(length)
+            except asyncio.IncompleteReadError:
+                return
+            finally:
+                if self.pending_headers is None:
+                    self.timer.cancel()
+            metrics.bytes_received.inc(('h2',), FRAME_HEADER_SIZE + length)
+
+            klass = factory.get(type_)
+            if klass is not None:
+                try:
+                    return klass(length, type_, flags, stream_identifier, memoryview(payload))
+                except FrameSizeError as e:
+                    logger.warning(e)
+                    await self.go_away(ErrorCodes.FRAME_SIZE_ERROR)
+                    return
+
+    async def handle_request(self, header, plan, methods, path_params, body=None):
+        """ Call the route function found by handle_stream and send the response.
+        Returns the status of the response.
+        """
         if header[':method'] not in methods:
             raise message.MethodNotAllowed()
 
-        reply_header = FrameBase.create(FrameTypes.HEADERS.value,
-                                        HeadersFlags.END_HEADERS.value,
-                                        header.stream_identifier)
-        reply_header[':status'] = HTTPStatus.OK.value
+        request = message.HTTPMessage(
+            message.RequestLine(header[':method'], header[':path'], 'HTTP/2'),
+            message.Headers(headers=[message.Header(k.title(), v)
+                                     for k, v in header.items() if not k.startswith(':')]))
+        if body is not None:
+            await self.prepare_body(plan, request, body)
+
+        if plan.cache is not None and header[':method'] in ('GET', 'HEAD'):
+            entry, res = await self.call_cached(plan, request, path_params)
+        else:
+            entry, res = None, await self.call_with_args(plan, request, path_params)
+
+        block = plan.headers or DEFAULT_BLOCK
+        if entry is not None:
+            # the header fields of the response are in the block of the entry
+            status, headers, body, block = entry.status, {}, entry.body, entry.block
+        elif isinstance(res, message.HTTPMessage):
+            status, headers, body = res.start_line.code, res.headers, res.body
+        else:
+            status, headers, body = HTTPStatus.OK, {}, self.make_body(res)
+        if status in (HTTPStatus.NO_CONTENT, HTTPStatus.NOT_MODIFIED) or header[':method'] == 'HEAD':
+            body = None
+
+        data = None
+        if body is not None and not isinstance(body, message.StreamingBody):
+            data = body if entry is not None else body.save()
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            data, extra = await self.compress(header.get('accept-encoding'), status, headers, block, data)
+            if extra:
+                headers = {**headers, **extra}
+
+        flags = HeadersFlags.END_HEADERS.value
+        if body is None:
+            flags |= HeadersFlags.END_STREAM.value
+        reply_header = self.create_headers(flags, header.stream_identifier)
+        reply_header[':status'] = int(status)
+        reply_header['date'] = date_cache.value
+        for k, v in block.fields.items():
+            reply_header[k.lower()] = v
+        for k, v in headers.items():
+            reply_header[k.lower()] = v
         await self.send_frame(reply_header)
+        self.responding.add(header.stream_identifier)
+
+        if body is None:
+            pass
+        elif data is None:
+            async for chunk in body:
+                await self.send_data(header.stream_identifier, chunk)
+            await self.send_data(header.stream_identifier, b'', end_stream=True)
+        else:
+            await self.send_data(header.stream_identifier, data, end_stream=True)
+        return status
+
+    def create_headers(self, flags, stream_identifier):
+        """ Create a HEADERS frame encoded with the HPACK context of this connection. """
+        frame = FrameBase.create(FrameTypes.HEADERS.value, flags, stream_identifier)
+        frame.encoder = self.encoder
+        frame.max_frame_size = self.max_frame_size
+        return frame
 
-        res = await fn()
-        res = res.encode('utf-8')
-        reply_data = FrameBase.create(FrameTypes.DATA.value,
-                                      DataFlags.END_STREAM.value,
-                                      header.stream_identifier,
-                                      res)
-        await self.send_frame(reply_data)
+    async def send_data(self, stream_identifier, data, end_stream=False):
+        """ Send data in DATA frames which are not larger than max_frame_size
+        and fit in the flow-control windows.
+        """
+        view = memoryview(data)
+        while True:
+            size = 0
+            if view:
+                size = await self.consume_window(stream_identifier, min(len(view), self.max_frame_size))
+            chunk, view = view[:size], view[size:]
+            flags = DataFlags.END_STREAM.value if end_stream and not view else 0x0
+            await self.send_frame(FrameBase.create(FrameTypes.DATA.value,
+                                                   flags,
+                                                   stream_identifier,
+                                                   chunk))
+            if not view:
+                break
+
+    async def consume_window(self, stream_identifier, size):
+        """ Wait until both of the windows of the connection and the stream are open,
+        then take at most size bytes from them. Returns the number of bytes taken.
+        Raises ConnectionResetError when the connection is lost while waiting.
+        """
+        async with self.window_updated:
+            await self.window_updated.wait_for(
+                lambda: self.lost or (self.client_window_size > 0
+                                      and self.client_stream_window_size.get(stream_identifier, 0) > 0))
+            if self.lost:
+                raise ConnectionResetError('the connection is lost')
+            size = min(size, self.client_window_size,
+                       self.client_stream_window_size[stream_identifier])
+            self.client_window_size -= size
+            self.client_stream_window_size[stream_identifier] -= size
+            return size
+
+    async def update_window(self, stream_identifier, increment):
+        async with self.window_updated:
+            if stream_identifier == 0:
+                self.client_window_size += increment
+            elif stream_identifier in self.client_stream_window_size:
+                self.client_stream_window_size[stream_identifier] += increment
+            self.window_updated.notify_all()
+
+    async def acknowledge_data(self, frame):
+        """ Feed a received DATA frame to the body of its stream. Send WINDOW_UPDATE for
+        the connection when half of its window is consumed. The window of the stream
+        is acknowledged by acknowledge_body() as the body is read, except for padding.
+        """
+        self.received += frame.length
+        if self.received >= self.window_size // 2:
+            await self.send_window_update(0, self.received)
+            self.received = 0
+
+        body = self.bodies.get(frame.stream_identifier)
+        if body is None:
+            return
+        body.feed(frame.data)
+        if frame.end_stream:
+            body.feed_eof()
+            del self.bodies[frame.stream_identifier]
+        elif frame.length > len(frame.data):
+            await self.acknowledge_body(frame.stream_identifier, frame.length - len(frame.data))
+
+    async def acknowledge_body(self, stream_identifier, size):
+        """ Send WINDOW_UPDATE for a stream when half of its window is read from its body. """
+        if stream_identifier not in self.bodies: # the client has sent all of the body
+            return
+        received = self.stream_received.get(stream_identifier, 0) + size
+        if received >= self.settings['initial_window_size'] // 2:
+            await self.send_window_update(stream_identifier, received)
+            received = 0
+        self.stream_received[stream_identifier] = received
+
+    async def send_window_update(self, stream_identifier, increment):
+        await self.send_frame(FrameBase.create(FrameTypes.WINDOW_UPDATE.value, 0x0,
+                                               stream_identifier,
+                                               increment.to_bytes(4, 'big', signed=False)))
+
+    async def send_settings(self, settings):
+        """ Send a SETTINGS frame of settings and wait for its ACK at most settings_timeout seconds. """
+        frame = FrameBase.create(FrameTypes.SETTINGS.value, 0x0, 0)
+        for k, v in settings.items():
+            setattr(frame, k, v)
+        await self.send_frame(frame)
+        loop = asyncio.get_running_loop()
+        self.pending_settings.append(loop.call_later(self.settings_timeout, self.settings_timed_out))
+
+    def read_timed_out(self):
+        """ Close the connection when it is idle too long or a client sends a frame too slowly. """
+        idle = not self.streams and self.pending_headers is None
+        if idle:
+            logger.debug('keep-alive timeout')
+        else:
+            logger.warning('read timeout')
+            metrics.errors.inc(('h2', 'timeout'))
+        asyncio.ensure_future(self.go_away(ErrorCodes.NO_ERROR if idle else ErrorCodes.ENHANCE_YOUR_CALM))
+        super(HTTP2Handler, self).read_timed_out()
+
+    def settings_timed_out(self):
+        logger.warning('SETTINGS is not acknowledged in {} seconds.'.format(self.settings_timeout))
+        asyncio.ensure_future(self.go_away(ErrorCodes.SETTINGS_TIMEOUT))
+        self.reader.feed_eof()
+
+    async def prioritize(self, stream_identifier, depends_on, weight, exclusive):
+        try:
+            self.scheduler.prioritize(stream_identifier, depends_on, weight, exclusive)
+        except ValueError as e: # RFC 7540 5.3.1: a stream cannot depend on itself
+            logger.warning(e)
+            await self.send_rst_stream(stream_identifier, ErrorCodes.PROTOCOL_ERROR)
+
+    async def handle_priority(self, frame):
+        """ PRIORITY frame. Frames of closed streams are ignored, and at most max_concurrent_streams
+        idle streams are kept in the dependency tree, the oldest one is removed first.
+        """
+        stream_identifier = frame.stream_identifier
+        if stream_identifier not in self.streams and stream_identifier not in self.idle:
+            if stream_identifier <= self.last_stream_id:
+                return
+            self.idle[stream_identifier] = None
+            if len(self.idle) > self.settings['max_concurrent_streams']:
+                self.scheduler.close(self.idle.popitem(last=False)[0])
+        await self.prioritize(stream_identifier, frame.dependent_stream, frame.weight, frame.exclusive)
+
+    async def send_rst_stream(self, stream_identifier, error_code):
+        metrics.errors.inc(('h2', error_code.name))
+        await self.send_frame(FrameBase.create(FrameTypes.RST_STREAM.value, 0x0,
+                                               stream_identifier, error_code.to_bytes()))
+
+    async def go_away(self, error_code):
+        """ Send GOAWAY as the last frame of this connection. """
+        if self.closed:
+            return
+        self.closed = True
+        metrics.errors.inc(('h2', error_code.name))
+        await self.send_frame(FrameBase.create(FrameTypes.GOAWAY.value, 0x0, 0,
+                                               self.last_stream_id.to_bytes(4, 'big', signed=False)
+                                               + error_code.to_bytes()))
+        await self.send_frame(None)
+
+    def close_stream(self, stream_identifier):
+        self.streams.pop(stream_identifier, None)
+        self.stream_received.pop(stream_identifier, None)
+        self.bodies.pop(stream_identifier, None)
+        self.responding.discard(stream_identifier)
+        if not self.streams and not self.timer.active and not self.closed:
+            self.timer.set(self.keep_alive_timeout)
+        self.scheduler.close(stream_identifier)
+        self.client_stream_window_size.pop(stream_identifier, None)
 
     async def handle_frame(self, frame):
+        metrics.frames.inc(('received', frame.FrameType().name))
+        # a header block is a HEADERS frame followed by CONTINUATION frames
+        # of the same stream without any other frames (RFC 7540 6.10)
+        if self.pending_headers is not None:
+            if frame.FrameType() != FrameTypes.CONTINUATION \
+                or frame.stream_identifier != self.pending_headers.stream_identifier:
+                await self.go_away(ErrorCodes.PROTOCOL_ERROR)
+                return
+            self.pending_headers.append(frame)
+            if not frame.end_headers:
+                return
+            frame, self.pending_headers = self.pending_headers, None
+
+        elif frame.FrameType() == FrameTypes.CONTINUATION:
+            await self.go_away(ErrorCodes.PROTOCOL_ERROR)
+            return
+
+        elif frame.FrameType() == FrameTypes.HEADERS and not frame.end_headers:
+            self.pending_headers = frame
+            return
+
         if frame.FrameType() == FrameTypes.HEADERS:
-            await self.handle_request(frame)
+            try:
+                frame.decode(self.decoder)
+            except HPACKError as e:
+                logger.warning(e)
+                await self.go_away(ErrorCodes.COMPRESSION_ERROR)
+                return
+            stream_identifier = frame.stream_identifier
+            if stream_identifier in self.streams:
+                # the trailer part of a request, which ends its body (RFC 7540 8.1)
+                body = self.bodies.pop(stream_identifier, None)
+                if body is None or not frame.end_stream:
+                    self.streams[stream_identifier].cancel()
+                    await self.send_rst_stream(stream_identifier, ErrorCodes.PROTOCOL_ERROR)
+                else:
+                    body.feed_eof()
+                return
+            if stream_identifier <= self.last_stream_id:
+                return # a closed stream, e.g. trailers after the response is complete
+            self.last_stream_id = stream_identifier
+            self.idle.pop(stream_identifier, None)
+            if len(self.streams) >= self.settings['max_concurrent_streams']:
+                logger.warning('stream {} is refused.'.format(stream_identifier))
+                self.scheduler.close(stream_identifier) # added by PRIORITY frames
+                await self.send_rst_stream(stream_identifier, ErrorCodes.REFUSED_STREAM)
+                return
+            self.client_stream_window_size[stream_identifier] = self.initial_window_size
+            if frame.priority:
+                await self.prioritize(stream_identifier, frame.stream_dependency,
+                                frame.priority_weight, frame.exclusive)
+            else:
+                self.scheduler.add(stream_identifier)
+            if not frame.end_stream:
+                try:
+                    length = int(frame.get('content-length'))
+                except (TypeError, ValueError):
+                    length = None
+                body = self.bodies[stream_identifier] = message.RequestStream(
+                    length, consumed=lambda size: self.acknowledge_body(stream_identifier, size),
+                    timeout=self.body_timeout, min_rate=self.min_body_rate)
+                body.timer = timers.timer(body.timed_out)
+            else:
+                body = None
+            task = asyncio.ensure_future(self.handle_stream(frame, body))
+            self.streams[stream_identifier] = task
+            task.add_done_callback(lambda t: self.close_stream(stream_identifier))
+
+        elif frame.FrameType() == FrameTypes.DATA:
+            await self.acknowledge_data(frame)
+
+        elif frame.FrameType() == FrameTypes.PRIORITY:
+            await self.handle_priority(frame)
+
+        elif frame.FrameType() == FrameTypes.RST_STREAM:
+            self.bodies.pop(frame.stream_identifier, None)
+            task = self.streams.get(frame.stream_identifier)
+            if task:
+                task.cancel()
+            self.scheduler.reset(frame.stream_identifier)
 
         elif frame.FrameType() == FrameTypes.SETTINGS:
             if frame.flags == 0x0:
                 await self.send_frame(FrameBase.create(FrameTypes.SETTINGS.value, 0x1, frame.stream_identifier))
-                if frame.initial_window_size:
-                    self.initial_window_size = frame.initial_window_size
+                if frame.initial_window_size is not None:
+                    # RFC 7540 6.9.2: the change applies to the windows of all open streams
+                    async with self.window_updated:
+                        delta = frame.initial_window_size - self.initial_window_size
+                        for k in self.client_stream_window_size:
+                            self.client_stream_window_size[k] += delta
+                        self.initial_window_size = frame.initial_window_size
+                        self.window_updated.notify_all()
+                if frame.max_frame_size:
+                    self.max_frame_size = frame.max_frame_size
+                if frame.header_table_size is not None:
+                    self.encoder.header_table_size = frame.header_table_size
 
             elif frame.flags == 0x1:
-                logger.debug('Got ACK')
+                if self.pending_settings:
+                    self.pending_settings.popleft().cancel()
+                    logger.debug('SETTINGS is acknowledged.')
+                else:
+                    logger.warning('unexpected SETTINGS ACK')
 
         elif frame.FrameType() == FrameTypes.WINDOW_UPDATE:
-            if frame.stream_identifier == 0:
-                self.client_window_size = frame.window_size
-            else:
-                self.client_stream_window_size[frame.stream_identifier] = frame.window_size
+            await self.update_window(frame.stream_identifier, frame.window_size)
 
     async def send_frame(self, frame):
-        self.writer.write(frame.save())
-        await self.writer.drain()
+        """ Queue a frame to the writer task. A DATA frame waits while its stream
+        has max_pending_frames frames which are not written yet.
+        """
+        if frame is not None and frame.FrameType() == FrameTypes.DATA:
+            async with self.frame_written:
+                await self.frame_written.wait_for(
+                    lambda: self.lost or self.scheduler.pending(frame.stream_identifier) < self.max_pending_frames)
+                if self.lost:
+                    raise ConnectionResetError('the connection is lost')
+                self.scheduler.push(frame.stream_identifier, frame)
+        else:
+            self.control.append(frame)
+        self.frame_queued.set()
 
     @staticmethod
     def handler_type():
@@ -226,63 +1161,168 @@ class HTTP2Handler(HandlerBase):
 class MyHTTPServer(object):
     """ HTTP Server class. When ssl_context or certfile is set,
     this server runs as a HTTPS server.
+
+    Under overload, at most max_connections connections and max_requests requests
+    are served at the same time (None for no limit), the other requests wait in a queue
+    of queue_size requests for queue_timeout seconds. See admission.Admission.
+    A connection over max_connections is closed after one response, which is 503
+    unless its route is CRITICAL, or after GOAWAY on HTTP/2.
+
+    Route functions registered with executor='thread' or 'process' run in a pool of
+    threads or processes workers, at most max_pending calls per pool. When offload_sync
+    is True, every non-coroutine route function runs in the thread pool unless its route
+    has executor=False. See executor.Offload.
     """
     def __init__(self, 
                  router = util.RouteRecord(),
                  # handlers = HTTP1_1Handler(self._route, request, writer),
-                 *, ssl_context =None, certfile=None, keyfile=None, password=None, **kwds):
+                 *, ssl_context =None, certfile=None, keyfile=None, password=None,
+                 keep_alive_timeout=5.0, max_keep_alive_requests=100,
+                 max_concurrent_streams=100, http2_settings=None, http2_window_size=None,
+                 compression=True, max_body_size=1 << 20, max_stream_size=None, spool_size=None,
+                 first_byte_timeout=10.0, header_timeout=10.0, body_timeout=10.0, min_body_rate=1024,
+                 max_request_line=8192, max_headers=100, max_header_size=65536,
+                 max_connections=None, max_requests=None, queue_size=100, queue_timeout=1.0, retry_after=1,
+                 threads=None, processes=None, max_pending=256, offload_sync=False,
+                 **kwds):
 
         # Create TLS context
         if ssl_context and certfile:
             raise TypeError('SSLContext and certfile must not be set at the same time')
 
+        self.ssl = None
         if ssl_context:
             self.ssl = ssl_context
         elif certfile:
             context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-            context.set_alpn_protocols(['HTTP/1.1', 'h2']) # to enable HTTP/2, add 'h2'
-            context.load_cert_chain('server.crt', keyfile='server.key')
+            context.set_alpn_protocols(['h2', 'http/1.1'])
+            context.load_cert_chain(certfile, keyfile=keyfile, password=password)
             context.options |= ssl.OP_NO_TLSv1 | ssl.OP_NO_TLSv1_1
             context.options |= ssl.OP_NO_COMPRESSION
             self.ssl = context
 
         self._route = router
-
-    def make_response(self, text):
-        status = message.StatusLine('HTTP/1.1', HTTPStatus.OK)
-        body = message.ResponseBody.load(text)
-        return message.HTTPMessage(start_line=status, body=body)
-
+        self.keep_alive_timeout = keep_alive_timeout
+        self.max_keep_alive_requests = max_keep_alive_requests
+        # SETTINGS parameters of HTTP/2 connections, see HTTP2Handler
+        self.http2_settings = {'max_concurrent_streams': max_concurrent_streams, **(http2_settings or {})}
+        self.http2_window_size = http2_window_size
+        # compression of response bodies: True for the default Compressor, a Compressor or False
+        self.compressor = Compressor() if compression is True else (compression or None)
+        # the first bytes (after the TLS handshake) must arrive within first_byte_timeout seconds
+        self.first_byte_timeout = first_byte_timeout
+        self.admission = Admission(max_connections=max_connections, max_requests=max_requests,
+                                   queue_size=queue_size, queue_timeout=queue_timeout,
+                                   retry_after=retry_after)
+        self.offload = Offload(threads=threads, processes=processes, max_pending=max_pending,
+                               sync=offload_sync)
+        # limits of requests, see HandlerBase
+        self.limits = {'max_body_size': max_body_size,
+                       'max_stream_size': max_stream_size,
+                       'spool_size': spool_size,
+                       'header_timeout': header_timeout,
+                       'body_timeout': body_timeout,
+                       'min_body_rate': min_body_rate,
+                       'max_request_line': max_request_line,
+                       'max_headers': max_headers,
+                       'max_header_size': max_header_size,
+                       'admission': self.admission,
+                       'offload': self.offload}
 
     async def client_connected_cb(self, reader, writer):
+        protocol = 'http/1.1'
         try:
-            request_data = await reader.read(24)
+            timer = timers.timer(lambda: stop_reading(reader, writer))
+            timer.set(self.first_byte_timeout)
+            try:
+                request_data = await reader.read(24)
+            finally:
+                timer.cancel()
+            if not request_data:
+                return
+
             if request_data == util.HTTP2:
                 logger.info('HTTP/2 connection is requested.')
+                protocol = 'h2'
+            metrics.connections.inc((protocol,))
+            metrics.bytes_received.inc((protocol,), len(request_data))
+            metrics.active_connections.inc((protocol,))
+            refused = not self.admission.connect(protocol)
+            try:
+                if protocol == 'h2':
+                    http2 = HandlerBase.find_handler(HandlerTypes.HTTP2)(
+                        self._route, reader, writer,
+                        settings=self.http2_settings, window_size=self.http2_window_size,
+                        keep_alive_timeout=self.keep_alive_timeout,
+                        compressor=self.compressor, refused=refused, **self.limits)
+                    await http2.run()
 
-                http2 = HandlerBase.find_handler(HandlerTypes.HTTP2)(self._route, reader, writer)
-                await http2.run()
-
-            else:
-                if reader.at_eof():
-                    raise message.RequestEntityTooLarge().with_traceback(sys.exc_info()[2])
-
-                handler = HandlerBase.find_handler(HandlerTypes.HTTP1_1)(self._route, reader, writer)
-                request = await handler.parse(request_data)
-                response = await handler.handle_request(request)
+                else:
+                    handler = HandlerBase.find_handler(HandlerTypes.HTTP1_1)(
+                        self._route, reader, writer, request_data,
+                        keep_alive_timeout=self.keep_alive_timeout,
+                        max_requests=1 if refused else self.max_keep_alive_requests,
+                        compressor=self.compressor, refused=refused, **self.limits)
+                    await handler.run()
+            finally:
+                metrics.active_connections.dec((protocol,))
+                if not refused:
+                    self.admission.disconnect()
 
         except Exception as e:
-            self.write_error(e, writer)
+            logger.error(e)
+            metrics.errors.inc((protocol, type(e).__name__))
 
         finally:
             writer.close()
 
-    async def run(self, port=80):
-        rsock_ = create_socket((None, port))
+    async def run(self, port=80, *, sock=None, **kwds):
+        """ Start serving on port and return the asyncio.Server.
+        sock is a listening socket to use instead of creating a new one,
+        other keyword arguments are passed to rsock.create_socket.
+        """
+        self.socket = sock or create_socket((None, port), **kwds)
+        date_cache.start(asyncio.get_running_loop())
         if self.ssl:
-            self.socket = self.ssl.wrap_socket(rsock_, server_side=True)
-        await asyncio.start_server(self.client_connected_cb, sock=self.socket)
+            return await asyncio.start_server(self.client_connected_cb, sock=self.socket, ssl=self.ssl,
+                                              ssl_handshake_timeout=self.first_byte_timeout)
+        return await asyncio.start_server(self.client_connected_cb, sock=self.socket)
+
+    def serve_forever(self, port=80, *, workers=1, reuse_port=None, timeout=30.0, **kwds):
+        """ Run the server until it is interrupted.
+        When workers is more than 1 (None means the number of CPUs), the process becomes
+        a supervisor of that many worker processes, each of which runs an event loop.
+        The workers bind the port with SO_REUSEPORT when reuse_port is true (the default
+        where it is available) or share a socket created by the supervisor.
+        A worker whose event loop does not respond for timeout seconds is killed and
+        respawned. Other keyword arguments are passed to rsock.create_socket.
+        """
+        if workers == 1:
+            asyncio.run(self._serve(port, **kwds))
+            return
+
+        if reuse_port is None:
+            reuse_port = hasattr(socket, 'SO_REUSEPORT')
+        sock = None if reuse_port else create_socket((None, port), **kwds)
+
+        def worker(fd):
+            asyncio.run(self._serve(port, sock=sock, heartbeat=fd, reuse_port=reuse_port, **kwds))
+
+        Supervisor(worker, workers, timeout=timeout).run()
+
+    async def _serve(self, port, *, heartbeat=None, **kwds):
+        server = await self.run(port, **kwds)
+        if heartbeat is not None:
+            start_heartbeat(heartbeat)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.offload.shutdown(wait=False)
+
+    def route(self, method='GET', path='/', **kwds):
+        return self._route.route(method=method, path=path, **kwds)
 
-    def route(self, method='GET', path='/'):
-        return self._route.route(method=method, path=path)
+    def static(self, path, directory, **kwds):
+        return self._route.static(path, directory, **kwds)
 
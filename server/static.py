@@ -0,0 +1,139 @@
+import os
+import mimetypes
+from http import HTTPStatus
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import unquote
+
+# private programs
+from . import message
+from .headers import etag_matches
+from .logger import get_logger_set
+logger, log = get_logger_set('static')
+
+
+class StaticFiles(object):
+    """ Route function which serves the files under directory.
+    prefix is the path of the route, it is removed from the request URI
+    to find the file. Supports Range (a single range), If-Range,
+    If-None-Match and If-Modified-Since.
+    """
+    def __init__(self, directory, prefix='/', chunk_size=65536):
+        self.directory = os.path.realpath(directory)
+        self.prefix = prefix
+        self.chunk_size = chunk_size
+
+    def __call__(self, request):
+        path = self.find_file(request.start_line.uri)
+        try:
+            stat = os.stat(path)
+        except (OSError, ValueError):
+            raise message.NotFound()
+
+        etag = '"{:x}-{:x}"'.format(stat.st_mtime_ns, stat.st_size)
+        last_modified = formatdate(stat.st_mtime, usegmt=True)
+        headers = message.Headers(headers=[message.Header('ETag', etag),
+                                           message.Header('Last-Modified', last_modified),
+                                           message.Header('Accept-Ranges', 'bytes'),
+                                           ])
+
+        if self.not_modified(request.headers, etag, int(stat.st_mtime)):
+            status = message.StatusLine('HTTP/1.1', HTTPStatus.NOT_MODIFIED)
+            return message.HTTPMessage(status, headers)
+
+        content_type, encoding = mimetypes.guess_type(path)
+        headers.set_header(message.Header('Content-Type', content_type or 'application/octet-stream'))
+
+        size = stat.st_size
+        status = message.StatusLine('HTTP/1.1', HTTPStatus.OK)
+        offset, count = 0, size
+
+        if self.if_range(request.headers, etag, last_modified):
+            range_ = self.parse_range(request.headers.get('Range'), size)
+            if range_ == ():
+                status = message.StatusLine('HTTP/1.1', HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                headers.set_header(message.Header('Content-Range', 'bytes */{}'.format(size)))
+                return message.HTTPMessage(status, headers, message.ResponseBody(''))
+
+            elif range_:
+                offset, count = range_
+                status = message.StatusLine('HTTP/1.1', HTTPStatus.PARTIAL_CONTENT)
+                headers.set_header(message.Header('Content-Range', 'bytes {}-{}/{}'.format(
+                    offset, offset + count - 1, size)))
+
+        body = message.FileBody(path, offset, count, self.chunk_size)
+        return message.HTTPMessage(status, headers, body)
+
+    def find_file(self, uri):
+        """ Returns the real path of the file requested by uri.
+        Raises NotFound when the path is out of the directory or is not a file.
+        """
+        path = unquote(uri.split('?', 1)[0])
+        if '\0' in path: # not a valid file name, os functions raise ValueError
+            raise message.NotFound()
+        if path.startswith(self.prefix):
+            path = path[len(self.prefix):]
+        try:
+            path = os.path.realpath(os.path.join(self.directory, path.lstrip('/')))
+            if os.path.commonpath([self.directory, path]) != self.directory \
+                or not os.path.isfile(path):
+                raise message.NotFound()
+        except ValueError:
+            raise message.NotFound()
+        return path
+
+    @staticmethod
+    def not_modified(headers, etag, mtime):
+        """ Evaluate If-None-Match, or If-Modified-Since when If-None-Match is absent (RFC 7232 6). """
+        if_none_match = headers.get('If-None-Match')
+        if if_none_match:
+            return etag_matches(if_none_match, etag)
+
+        if_modified_since = headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                return mtime <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    @staticmethod
+    def if_range(headers, etag, last_modified):
+        """ Returns False when If-Range does not match the file, then Range is ignored. """
+        value = headers.get('If-Range')
+        return not value or value in (etag, last_modified)
+
+    @staticmethod
+    def parse_range(value, size):
+        """ Parse a Range header which has a single byte range.
+        Returns a pair (offset, count), () when the range is not satisfiable
+        or None when the whole file should be sent.
+        """
+        if not value or not value.startswith('bytes='):
+            return None
+
+        ranges = value[len('bytes='):].split(',')
+        if len(ranges) != 1: # multipart/byteranges is not supported, send the whole file.
+            return None
+
+        first, sep, last = ranges[0].strip().partition('-')
+        try:
+            if not first: # suffix-byte-range-spec
+                length = int(last)
+                if length <= 0 or size == 0:
+                    return ()
+                first = max(size - length, 0)
+                last = size - 1
+            else:
+                first = int(first)
+                last = int(last) if last else size - 1
+        except ValueError:
+            return None
+
+        if not sep:
+            return None
+        if first >= size:
+            return ()
+        if first > last:
+            return None
+        last = min(last, size - 1)
+        return first, last - first + 1
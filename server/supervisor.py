@@ -0,0 +1,137 @@
+import os
+import time
+import signal
+import select
+import asyncio
+
+# private programs
+from .logger import get_logger_set
+logger, log = get_logger_set('supervisor')
+
+
+class Supervisor(object):
+    """ Pre-fork supervisor. It forks workers processes which call target(fd),
+    where fd is the write end of a pipe. A worker must write to it at least every
+    timeout seconds (see start_heartbeat), otherwise the supervisor kills it.
+    Workers which exit or are killed are respawned until the supervisor
+    receives SIGINT or SIGTERM, then the workers are terminated.
+    """
+    def __init__(self, target, workers=None, timeout=30.0, interval=1.0):
+        self.target = target
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.interval = interval
+        self.children = {} # pid -> Worker
+        self.running = False
+
+    def spawn(self):
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0: # worker
+            os.close(r)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            code = 0
+            try:
+                self.target(w)
+            except BaseException as e:
+                logger.error(e)
+                code = 1
+            finally:
+                os._exit(code)
+
+        os.close(w)
+        self.children[pid] = Worker(pid, r)
+        logger.info('worker {} is started.'.format(pid))
+        return pid
+
+    def stop(self, signum=None, frame=None):
+        self.running = False
+
+    def run(self):
+        self.running = True
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+
+        for _ in range(self.workers):
+            self.spawn()
+
+        try:
+            while self.running:
+                self.monitor()
+        finally:
+            self.terminate()
+
+    def monitor(self):
+        """ Read heartbeats, reap exited workers, kill unresponsive ones and respawn. """
+        fds = {x.fd: x for x in self.children.values() if x.fd is not None}
+        try:
+            ready, _, _ = select.select(list(fds), [], [], self.interval)
+        except InterruptedError:
+            ready = []
+
+        now = time.monotonic()
+        for fd in ready:
+            if os.read(fd, 4096):
+                fds[fd].last = now
+            else: # the worker has exited
+                fds[fd].close()
+
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+            self.children.pop(pid).close()
+            logger.warning('worker {} exited with status {}.'.format(pid, status))
+            if self.running:
+                self.spawn()
+
+        for x in self.children.values():
+            if not x.killed and now - x.last > self.timeout:
+                logger.error('worker {} does not respond, kill it.'.format(x.pid))
+                os.kill(x.pid, signal.SIGKILL)
+                x.killed = True
+
+    def terminate(self):
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid, x in self.children.items():
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+            x.close()
+        self.children.clear()
+
+
+class Worker(object):
+    """ A worker process seen from the supervisor. """
+    def __init__(self, pid, fd):
+        self.pid = pid
+        self.fd = fd # read end of the heartbeat pipe
+        self.last = time.monotonic() # time of the last heartbeat
+        self.killed = False
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def start_heartbeat(fd, interval=1.0, loop=None):
+    """ Write to fd every interval seconds from the event loop, so that
+    the supervisor knows the loop of this worker is not blocked.
+    """
+    loop = loop or asyncio.get_running_loop()
+
+    def beat():
+        try:
+            os.write(fd, b'.')
+        except OSError: # the supervisor has gone
+            return
+        loop.call_later(interval, beat)
+
+    beat()
@@ -0,0 +1,103 @@
+import math
+import asyncio
+
+# private programs
+from .logger import get_logger_set
+logger, log = get_logger_set('timer')
+
+
+class TimerWheel(object):
+    """ Coarse timers for deadlines of connections, e.g. read timeouts.
+    A deadline is rounded up to a tick of resolution seconds and the timer is kept
+    in the bucket of the tick, so that setting, moving and cancelling a timer is
+    a dict operation and the event loop has a single timer for the next tick,
+    however many connections are open. A timer fires at most resolution seconds late.
+    """
+    def __init__(self, resolution=0.25):
+        self.resolution = resolution
+        self.buckets = {} # tick -> dict of Timer -> None, in the order of setting
+        self.loop = None
+        self.handle = None
+        self.next_tick = None # the tick self.handle fires at
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets.values())
+
+    def timer(self, callback):
+        """ Returns a new Timer which calls callback() when it expires. """
+        return Timer(self, callback)
+
+    def add(self, timer, delay):
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop: # timers of a closed event loop are dropped
+            self.stop()
+            self.buckets.clear()
+            self.loop = loop
+        tick = math.ceil((loop.time() + delay) / self.resolution)
+        bucket = self.buckets.get(tick)
+        if bucket is None:
+            bucket = self.buckets[tick] = {}
+        bucket[timer] = None
+        timer.tick = tick
+        if self.handle is None or tick < self.next_tick:
+            self.schedule(tick)
+
+    def remove(self, timer):
+        bucket = self.buckets.get(timer.tick)
+        if bucket is not None:
+            bucket.pop(timer, None)
+            if not bucket:
+                del self.buckets[timer.tick]
+        timer.tick = None
+
+    def schedule(self, tick):
+        self.stop()
+        self.next_tick = tick
+        self.handle = self.loop.call_at(tick * self.resolution, self.expire)
+
+    def stop(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+
+    def expire(self):
+        self.handle = None
+        # the loop may call the handle slightly before its time
+        now = max(self.next_tick, self.loop.time() / self.resolution)
+        for tick in sorted(k for k in self.buckets if k <= now):
+            for timer in self.buckets.pop(tick):
+                timer.tick = None
+                try:
+                    timer.callback()
+                except Exception as e:
+                    logger.error(e)
+        if self.buckets and self.handle is None:
+            self.schedule(min(self.buckets))
+
+
+class Timer(object):
+    """ A deadline of a TimerWheel. set() (re)starts it, cancel() stops it. """
+    __slots__ = ('wheel', 'callback', 'tick')
+
+    def __init__(self, wheel, callback):
+        self.wheel = wheel
+        self.callback = callback
+        self.tick = None
+
+    def set(self, delay):
+        """ Call the callback after delay seconds, or never if delay is None. """
+        if self.tick is not None:
+            self.wheel.remove(self)
+        if delay is not None:
+            self.wheel.add(self, delay)
+
+    def cancel(self):
+        if self.tick is not None:
+            self.wheel.remove(self)
+
+    @property
+    def active(self):
+        return self.tick is not None
+
+
+timers = TimerWheel()
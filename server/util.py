@@ -1,4 +1,5 @@
 from functools import wraps
+import inspect
 
 class serializable(object):
     """ This is ABC of util.serializable classes. Any derived class of this class
@@ -19,7 +20,7 @@ class serializable(object):
 
 import datetime
 # RFC 5322 Date and Time specification
-IMFFixdate = '%a, %d %b %Y %H:%M:%S %Z'
+IMFFixdate = '%a, %d %b %Y %H:%M:%S GMT'
 
 
 import re
@@ -29,64 +30,273 @@ HTTP2 = b'PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n'
 # 0x505249202a20485454502f322e300d0a0d0a534d0d0a0d0a
 
 # http://taichino.com/programming/1538
-from collections import UserDict
+from collections import UserDict, OrderedDict
+
+# types of path parameters, e.g. /user/{id:int}. A pair of a pattern of the segment and a converter.
+PathParameterTypes = {
+    'str': (re.compile(r'[^/]+'), str),
+    'int': (re.compile(r'[0-9]+'), int),
+    'float': (re.compile(r'[0-9]+(?:\.[0-9]+)?'), float),
+    'path': (re.compile(r'.*'), str), # the rest of the path, must be the last segment
+}
+_parameter = re.compile(r'\{(\w+)(?::(\w+))?\}')
+
+
+def _parameter_type(m):
+    """ Returns the type name of a match of _parameter, raises ValueError if it is unknown. """
+    type_ = m.group(2) or 'str'
+    if type_ not in PathParameterTypes:
+        raise ValueError('unknown type of path parameter: {}'.format(m.group(0)))
+    return type_
+
+
+def _compile_segment(segment):
+    """ Returns a regular expression of a segment which mixes parameters and static text,
+    e.g. {id:int}.json, and a dict of the converters of its parameters.
+    """
+    pattern, converters, pos = [], {}, 0
+    for m in _parameter.finditer(segment):
+        name, type_ = m.group(1), _parameter_type(m)
+        if type_ == 'path':
+            raise ValueError('a path parameter must be a whole segment: {}'.format(segment))
+        regex, converters[name] = PathParameterTypes[type_]
+        pattern.append(re.escape(segment[pos:m.start()]))
+        pattern.append('(?P<{}>{})'.format(name, regex.pattern))
+        pos = m.end()
+    pattern.append(re.escape(segment[pos:]))
+    return re.compile(''.join(pattern)), converters
+
+
+class CallPlan(object):
+    """ How to call a route function. It is computed once when the function
+    is registered, so that a request does not need to inspect the function.
+    """
+    __slots__ = ('fn', 'parameters', 'wants_request', 'is_coroutine', 'headers', 'route', 'cache', 'stream',
+                 'priority', 'executor')
+
+    def __init__(self, fn, headers=None, cache=None, stream=False, priority=None, executor=None):
+        self.fn = fn
+        self.headers = headers # headers.HeaderBlock of the route, None for the default one
+        self.cache = cache # cache.ResponseCache of the route, None if responses are not cached
+        self.stream = stream # the request body is given as a message.RequestStream, not parsed
+        # Priority of admission control, see admission.Admission
+        self.priority = Priority.NORMAL if priority is None else Priority(priority)
+        self.route = None # the path the function is registered at
+        sig = inspect.signature(fn)
+        self.parameters = frozenset(k for k, v in sig.parameters.items()
+                                    if k != 'request' and v.kind in (v.POSITIONAL_OR_KEYWORD, v.KEYWORD_ONLY))
+        self.wants_request = 'request' in sig.parameters
+        self.is_coroutine = inspect.iscoroutinefunction(inspect.unwrap(fn)) \
+            or inspect.iscoroutinefunction(getattr(fn, '__call__', None))
+        # 'thread' or 'process' to run the function in an executor, see executor.Offload,
+        # False to run it in the event loop, None for the default of the server
+        if executor not in (None, False, 'thread', 'process'):
+            raise ValueError('unknown executor {!r}'.format(executor))
+        if executor and self.is_coroutine:
+            raise TypeError('coroutine function {} runs in the event loop'.format(getattr(fn, '__name__', fn)))
+        if executor == 'process' and stream:
+            raise TypeError('a streamed request body cannot be sent to a process')
+        self.executor = executor
+
+    def __repr__(self):
+        return 'CallPlan({})'.format(getattr(self.fn, '__name__', self.fn))
+
+
+class _Node(object):
+    """ A node of the segment trie of RouteRecord. """
+    __slots__ = ('static', 'patterns', 'params', 'value')
+
+    def __init__(self):
+        self.static = {} # segment -> _Node
+        self.patterns = [] # list of (segment, regular expression, converters, _Node), e.g. {id:int}.json
+        self.params = [] # list of (name, type name, _Node)
+        self.value = None
+
+
 class RouteRecord(UserDict):
-    """docstring for RouteRecord"""
-    def __init__(self, *args, **kwds):
-        super(RouteRecord, self).__init__(*args, **kwds)
+    """ Routing table. Paths are split into segments and stored in a trie.
+    A segment is a static string, a typed parameter like {id:int}
+    (see PathParameterTypes) or static text with parameters like {id:int}.json.
+    Paths are matched literally, e.g. a dot is a dot. Regular expressions
+    are given as re.Pattern objects, which are matched one by one after the trie.
+    Recent lookups are kept in an LRU cache of cache_size entries.
+    """
+    def __init__(self, *args, cache_size=1024, **kwds):
+        self.root_ = _Node()
+        self.static_ = {}
         self.regex_ = {}
+        self.cache_ = OrderedDict()
+        self.cache_size = cache_size
+        super(RouteRecord, self).__init__(*args, **kwds)
 
     def __setitem__(self, key, value):
+        self.cache_.clear()
+        fn, methods = value
+        if not isinstance(fn, CallPlan):
+            value = (CallPlan(fn), methods)
+        value[0].route = key.pattern if isinstance(key, re.Pattern) else key
+
         if isinstance(key, re.Pattern):
             self.regex_[key] = value
+            return
+
+        self.data[key] = value
+        if not _parameter.search(key):
+            self.static_[key] = value
+
         else:
-            self.data[key] = value
-            if key[-1] != '$':
-                key = key + '$'
-            self.regex_[re.compile(key)] = value
+            node = self.root_
+            for segment in key.split('/')[1:]:
+                m = _parameter.fullmatch(segment)
+                if m:
+                    name, type_ = m.group(1), _parameter_type(m)
+                    for x in node.params:
+                        if x[0] == name and x[1] == type_:
+                            node = x[2]
+                            break
+                    else:
+                        child = _Node()
+                        node.params.append((name, type_, child))
+                        node = child
+                elif _parameter.search(segment):
+                    for x in node.patterns:
+                        if x[0] == segment:
+                            node = x[3]
+                            break
+                    else:
+                        child = _Node()
+                        node.patterns.append((segment, *_compile_segment(segment), child))
+                        node = child
+                else:
+                    node = node.static.setdefault(segment, _Node())
+            node.value = value
 
     def __getitem__(self, key):
-        try:
-            return self.data[key]
-        except:
-            for k, v in self.regex_.items():
-                if k.match(key):
-                    return v
-            raise KeyError('{} is not found'.format(key))
+        return self.match(key)[0]
 
     def __contains__(self, item):
-        if item in self.data:
-            return True
-        else:
-            for k in self.regex_.keys():
-                m = k.match(item)
-                _logger.debug('{} matches {}? {}'.format(k, item, m))
-                if m:
-                    return True
+        try:
+            self.match(item)
+        except KeyError:
+            return False
+        return True
 
-        return False
+    def match(self, path):
+        """ Returns a pair of the value registered for path and
+        a dict of path parameters. Raises KeyError when path is not found.
+        """
+        path = path.split('?', 1)[0]
+        try:
+            result = self.cache_[path]
+            self.cache_.move_to_end(path)
+        except KeyError:
+            result = self._match(path)
+            self.cache_[path] = result
+            if len(self.cache_) > self.cache_size:
+                self.cache_.popitem(last=False)
+
+        if result is None:
+            raise KeyError('{} is not found'.format(path))
+        return result
+
+    def _match(self, path):
+        try:
+            return self.static_[path], {}
+        except KeyError:
+            pass
+
+        params = {}
+        value = self._match_node(self.root_, path.split('/')[1:], 0, params)
+        if value is not None:
+            return value, params
+
+        for k, v in self.regex_.items():
+            m = k.match(path)
+            if m:
+                return v, m.groupdict()
+        return None
+
+    def _match_node(self, node, segments, i, params):
+        if i == len(segments):
+            return node.value
+
+        segment = segments[i]
+        child = node.static.get(segment)
+        if child is not None:
+            value = self._match_node(child, segments, i + 1, params)
+            if value is not None:
+                return value
+
+        for _, regex, converters, child in node.patterns:
+            m = regex.fullmatch(segment)
+            if m:
+                found = {k: converters[k](v) for k, v in m.groupdict().items()}
+                params.update(found)
+                value = self._match_node(child, segments, i + 1, params)
+                if value is not None:
+                    return value
+                for k in found:
+                    params.pop(k, None)
+
+        for name, type_, child in node.params:
+            pattern, converter = PathParameterTypes[type_]
+            if type_ == 'path':
+                params[name] = '/'.join(segments[i:])
+                if child.value is not None:
+                    return child.value
+            elif pattern.fullmatch(segment):
+                params[name] = converter(segment)
+                value = self._match_node(child, segments, i + 1, params)
+                if value is not None:
+                    return value
+            params.pop(name, None)
+        return None
 
     def find(self, path):
-        m = self.__getitem__(path)
-        return m[0], m[1]
+        """ Returns a tuple of the CallPlan, the allowed methods and the path parameters. """
+        m, params = self.match(path)
+        return m[0], m[1], params
+
+    def route(self, method='GET', path='/', headers=None, cache=None, stream=False, priority=None,
+              executor=None):
+        """ Register a function in the routing table of this server.
+        headers is a dict of header fields sent with every response of the route.
+        cache is a cache.ResponseCache, or the number of seconds of the TTL of one,
+        which caches the responses to GET and HEAD requests of the route.
+        If stream is True, request.body is a message.RequestStream which the function
+        reads as the body arrives, instead of the body parsed in memory.
+        priority is a Priority of admission control under overload, e.g. Priority.CRITICAL
+        for health checks, which are never shed.
+        executor is 'thread' or 'process' to run a blocking function in an executor
+        of the server instead of the event loop, False to keep it in the event loop.
+        """
+        from .headers import HeaderBlock, DEFAULT_FIELDS
+        from .cache import ResponseCache
+        block = HeaderBlock({**DEFAULT_FIELDS, **headers}) if headers else None
+        if isinstance(cache, (int, float)):
+            cache = ResponseCache(cache)
 
-    def route(self, method='GET', path='/'):
-        """ Register a function in the routing table of this server. """
         def register(fn):
             @wraps(fn)
             def wrapper(*args, **kwds):
                 return fn(*args, **kwds)
 
             if isinstance(method, str):
-                self.__setitem__(path, (wrapper, [method]))
+                self.__setitem__(path, (CallPlan(fn, block, cache, stream, priority, executor), [method]))
             else:
-                self.__setitem__(path, (wrapper, method))
+                self.__setitem__(path, (CallPlan(fn, block, cache, stream, priority, executor), method))
 
             return wrapper
         return register
 
+    def static(self, path, directory, method=['GET', 'HEAD'], **kwds):
+        """ Register a route which serves the files under directory at path. """
+        from .static import StaticFiles
+        prefix = path.rstrip('/') + '/'
+        return self.route(method=method, path=prefix + '{path:path}')(StaticFiles(directory, prefix, **kwds))
+
 # type definitions
-from enum import Enum, auto
+from enum import Enum, IntEnum, auto
 
 class MessageType(Enum):
     REQUEST = auto()
@@ -102,3 +312,8 @@ class TransferCodings(Enum):
     DEFLATE = 'deflate'
     GZIP = 'gzip'
 
+class Priority(IntEnum):
+    LOW = 0
+    NORMAL = 1
+    HIGH = 2
+    CRITICAL = 3
@@ -0,0 +1,85 @@
+""" Clients of a server run in the test: a raw HTTP/1.1 client, to check the bytes
+of responses, and an HTTP/2 client which collects the events of h2.
+"""
+import asyncio
+
+import h2.config
+import h2.events
+import h2.connection
+
+from server.rsock import create_socket
+from server.server import MyHTTPServer
+
+
+async def _serve(server, client, *args):
+    sock = create_socket(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    async with await server.run(sock=sock):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        try:
+            return await client(reader, writer, *args)
+        finally:
+            writer.close()
+
+
+async def _exchange(reader, writer, data, timeout):
+    writer.write(data)
+    return await asyncio.wait_for(reader.read(), timeout)
+
+
+def exchange(router, data, *, timeout=5.0, **kwds):
+    """ Send data to a server of router and return what it writes until the connection is closed.
+    Other keyword arguments are passed to MyHTTPServer.
+    """
+    return asyncio.run(_serve(MyHTTPServer(router, **kwds), _exchange, data, timeout))
+
+
+async def _h2_exchange(reader, writer, paths, timeout):
+    conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=True))
+    conn.initiate_connection()
+    streams = {}
+    for path in paths:
+        stream_id = conn.get_next_available_stream_id()
+        conn.send_headers(stream_id, [(':method', 'GET'), (':path', path), (':scheme', 'http'),
+                                      (':authority', 'localhost')], end_stream=True)
+        streams[stream_id] = []
+    writer.write(conn.data_to_send())
+
+    open_ = set(streams)
+    while open_:
+        data = await asyncio.wait_for(reader.read(65536), timeout)
+        if not data:
+            break
+        for event in conn.receive_data(data):
+            stream_id = getattr(event, 'stream_id', None)
+            if stream_id not in streams:
+                continue
+            if isinstance(event, h2.events.DataReceived):
+                conn.acknowledge_received_data(event.flow_controlled_length, stream_id)
+            streams[stream_id].append(event)
+            if isinstance(event, (h2.events.StreamEnded, h2.events.StreamReset)):
+                open_.discard(stream_id)
+        writer.write(conn.data_to_send())
+    return [streams[x] for x in sorted(streams)]
+
+
+def h2_exchange(router, paths, *, timeout=5.0, **kwds):
+    """ Send GET requests of paths on an HTTP/2 connection to a server of router.
+    Returns a list of the h2.events of each request. Other keyword arguments are passed to MyHTTPServer.
+    """
+    return asyncio.run(_serve(MyHTTPServer(router, **kwds), _h2_exchange, paths, timeout))
+
+
+def split(data):
+    """ Returns a list of (head, body) of the responses in data, which have Content-Length. """
+    res = []
+    while data:
+        head, _, data = data.partition(b'\r\n\r\n')
+        length = 0
+        for line in head.split(b'\r\n')[1:]:
+            k, _, v = line.partition(b':')
+            if k.lower() == b'content-length':
+                length = int(v)
+        res.append((head.decode('latin-1'), data[:length]))
+        data = data[length:]
+    return res
@@ -0,0 +1,36 @@
+""" Compression of response bodies (server.compression). """
+import gzip
+import asyncio
+
+from server import util
+from server.compression import Compressor
+from tests.client import exchange, split
+
+
+def test_cache_distinguishes_bodies_of_an_etag():
+    compressor = Compressor()
+    a = asyncio.run(compressor.compress(b'a' * 2000, 'gzip', '"1"'))
+    b = asyncio.run(compressor.compress(b'b' * 2000, 'gzip', '"1"'))
+    assert gzip.decompress(a) == b'a' * 2000
+    assert gzip.decompress(b) == b'b' * 2000
+    assert asyncio.run(compressor.compress(b'a' * 2000, 'gzip', '"1"')) is a
+
+
+def test_routes_sharing_an_etag():
+    router = util.RouteRecord()
+
+    @router.route('GET', '/a', headers={'ETag': '"1"'})
+    def a():
+        return 'a' * 2000
+
+    @router.route('GET', '/b', headers={'ETag': '"1"'})
+    def b():
+        return 'b' * 2000
+
+    data = exchange(router, b'GET /a HTTP/1.1\r\nHost: x\r\nAccept-Encoding: gzip\r\n\r\n'
+                            b'GET /b HTTP/1.1\r\nHost: x\r\nAccept-Encoding: gzip\r\n'
+                            b'Connection: close\r\n\r\n')
+    (head_a, body_a), (head_b, body_b) = split(data)
+    assert 'Content-Encoding: gzip' in head_a and 'Content-Encoding: gzip' in head_b
+    assert gzip.decompress(body_a) == b'a' * 2000
+    assert gzip.decompress(body_b) == b'b' * 2000
@@ -0,0 +1,44 @@
+""" Parsing of HTTP/2 frames (server.frame). """
+import pytest
+
+from server import util
+from server.frame import FrameBase, FrameTypes, FrameSizeError, ErrorCodes, FRAME_HEADER_SIZE
+from server.frame import pack_header, unpack_header
+from tests.client import exchange
+
+
+def frame(type_, payload, flags=0x0, stream_identifier=0):
+    return pack_header(len(payload), type_.value, flags, stream_identifier) + payload
+
+
+@pytest.mark.parametrize('type_, payload, stream_identifier', [
+    (FrameTypes.WINDOW_UPDATE, b'\x00\x00\x01', 0),
+    (FrameTypes.RST_STREAM, b'\x00\x00\x00\x00\x00', 1),
+    (FrameTypes.PRIORITY, b'\x00\x00\x00\x00', 1),
+    (FrameTypes.GOAWAY, b'\x00\x00\x00\x00', 0),
+    (FrameTypes.SETTINGS, b'\x00\x04\x00\x00\xff\xff\x00', 0),
+])
+def test_payload_of_a_wrong_length(type_, payload, stream_identifier):
+    with pytest.raises(FrameSizeError):
+        FrameBase.load(frame(type_, payload, stream_identifier=stream_identifier))
+
+
+def test_settings_ack_with_payload():
+    with pytest.raises(FrameSizeError):
+        FrameBase.load(frame(FrameTypes.SETTINGS, b'\x00\x04\x00\x00\xff\xff', flags=0x1))
+
+
+def test_headers_without_priority_fields():
+    with pytest.raises(FrameSizeError):
+        FrameBase.load(frame(FrameTypes.HEADERS, b'\x00\x00', flags=0x24, stream_identifier=1))
+
+
+def test_wrong_length_closes_the_connection():
+    data = exchange(util.RouteRecord(), util.HTTP2 + frame(FrameTypes.SETTINGS, b'')
+                    + frame(FrameTypes.WINDOW_UPDATE, b'\x00\x00\x01'))
+    frames = []
+    while data:
+        frames.append(FrameBase.load(data))
+        data = data[FRAME_HEADER_SIZE + unpack_header(data)[0]:]
+    assert frames[-1].FrameType() == FrameTypes.GOAWAY
+    assert frames[-1].error_code == ErrorCodes.FRAME_SIZE_ERROR.value
@@ -0,0 +1,32 @@
+""" Responses of HTTP/1.1 connections (server.server.HTTP1_1Handler). """
+from server import util
+from tests.client import exchange, split
+
+
+def test_error_of_a_route_closes_the_connection():
+    router = util.RouteRecord()
+
+    @router.route('GET', '/error')
+    def error():
+        raise ValueError('error')
+
+    data = exchange(router, b'GET /error HTTP/1.1\r\nHost: x\r\n\r\n'
+                            b'GET /error HTTP/1.1\r\nHost: x\r\n\r\n')
+    (head, body), = split(data)
+    assert head.startswith('HTTP/1.1 500 ')
+    assert 'Connection: close' in head
+
+
+def test_transfer_encoding_and_content_length_close_the_connection():
+    router = util.RouteRecord()
+
+    @router.route('POST', '/')
+    def index():
+        return 'index'
+
+    data = exchange(router, b'POST / HTTP/1.1\r\nHost: x\r\nContent-Length: 4\r\n'
+                            b'Transfer-Encoding: chunked\r\n\r\n0\r\n\r\n'
+                            b'GET /smuggled HTTP/1.1\r\nHost: x\r\n\r\n')
+    (head, body), = split(data)
+    assert head.startswith('HTTP/1.1 200 ')
+    assert 'Connection: close' in head
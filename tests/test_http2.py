@@ -0,0 +1,67 @@
+""" Responses of HTTP/2 streams (server.server.HTTP2Handler). """
+import asyncio
+
+import h2.events
+from h2.errors import ErrorCodes
+
+from server import message, util
+from server.frame import FrameBase, FrameTypes
+from server.server import HTTP2Handler
+from tests.client import h2_exchange
+
+
+def headers_of(events):
+    return [dict(x.headers) for x in events if isinstance(x, h2.events.ResponseReceived)]
+
+
+def test_service_unavailable_of_a_route_is_a_response():
+    router = util.RouteRecord()
+
+    @router.route('GET', '/busy')
+    def busy():
+        raise message.ServiceUnavailable(30)
+
+    events, = h2_exchange(router, ['/busy'])
+    headers, = headers_of(events)
+    assert headers[b':status'] == b'503'
+    assert headers[b'retry-after'] == b'30'
+    assert not any(isinstance(x, h2.events.StreamReset) for x in events)
+
+
+def test_shed_request_is_refused():
+    router = util.RouteRecord()
+
+    @router.route('GET', '/low', priority=util.Priority.LOW)
+    def low():
+        return 'low'
+
+    events, = h2_exchange(router, ['/low'], max_requests=0)
+    reset, = [x for x in events if isinstance(x, h2.events.StreamReset)]
+    assert reset.error_code == ErrorCodes.REFUSED_STREAM
+
+
+def priority(stream_identifier, depends_on=0, weight=16):
+    return FrameBase.create(FrameTypes.PRIORITY.value, 0x0, stream_identifier,
+                            depends_on.to_bytes(4, 'big') + bytes([weight - 1]))
+
+
+def test_priority_of_idle_and_closed_streams():
+    async def main():
+        handler = HTTP2Handler(util.RouteRecord(), None, None, settings={'max_concurrent_streams': 10})
+        for i in range(1, 2001, 2):
+            await handler.handle_frame(priority(i))
+        # only the newest idle streams are kept
+        assert len(handler.scheduler.streams) == 1 + 10
+        assert 1999 in handler.scheduler and 1 not in handler.scheduler
+
+        handler.last_stream_id = 3001
+        for i in range(2001, 3001, 2):
+            await handler.handle_frame(priority(i))
+        assert len(handler.scheduler.streams) == 1 + 10
+        assert 2001 not in handler.scheduler
+
+        # an idle stream which is kept can be prioritized again
+        await handler.handle_frame(priority(1999, weight=32))
+        assert handler.scheduler.streams[1999].weight == 32
+
+    asyncio.run(main())
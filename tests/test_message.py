@@ -0,0 +1,29 @@
+""" Parsing of HTTP/1.1 requests by message.RequestParser. """
+from server import message, util
+from tests.client import exchange, split
+
+
+def test_field_names_are_case_insensitive():
+    request = message.RequestParser(b'POST / HTTP/1.1\r\n'
+                                    b'host: x\r\n'
+                                    b'ACCEPT-ENCODING: gzip\r\n'
+                                    b'content-length: 3\r\n'
+                                    b'\r\nabc').head()
+    assert request.headers['Host'] == 'x'
+    assert request.headers['Accept-Encoding'] == 'gzip'
+    assert request.headers['Content-Length'] == '3'
+
+
+def test_connection_close_in_lower_case():
+    router = util.RouteRecord()
+
+    @router.route('GET', '/')
+    def index():
+        return 'index'
+
+    data = exchange(router, b'GET / HTTP/1.1\r\nhost: x\r\nconnection: close\r\n\r\n'
+                            b'GET / HTTP/1.1\r\nhost: x\r\n\r\n')
+    responses = split(data)
+    assert len(responses) == 1
+    assert 'Connection: close' in responses[0][0]
+
@@ -0,0 +1,46 @@
+""" Lookup of routes by util.RouteRecord. """
+import re
+
+import pytest
+
+from server.util import RouteRecord
+
+
+def make_router(*paths):
+    router = RouteRecord()
+    for path in paths:
+        router[path] = (make_router, [path])
+    return router
+
+
+def find(router, path):
+    value, params = router.match(path)
+    return value[1][0], params
+
+
+def test_dots_are_literal():
+    router = make_router('/favicon.ico', '/api/v1.0/{name}')
+    assert find(router, '/favicon.ico') == ('/favicon.ico', {})
+    assert find(router, '/api/v1.0/users') == ('/api/v1.0/{name}', {'name': 'users'})
+    for path in ('/faviconXico', '/api/v1x0/users'):
+        with pytest.raises(KeyError):
+            router.match(path)
+
+
+def test_parameters_inside_a_segment():
+    router = make_router('/user/{id:int}.json', '/user/{name}', '/v{major:int}.{minor:int}/info')
+    assert find(router, '/user/5.json') == ('/user/{id:int}.json', {'id': 5})
+    assert find(router, '/user/x.json') == ('/user/{name}', {'name': 'x.json'})
+    assert find(router, '/v1.2/info') == ('/v{major:int}.{minor:int}/info', {'major': 1, 'minor': 2})
+    with pytest.raises(ValueError):
+        make_router('/files/{rest:path}.json')
+    with pytest.raises(ValueError):
+        make_router('/user/{id:uuid}.json')
+
+
+def test_patterns():
+    pattern = re.compile(r'/item/(?P<id>[0-9]+)')
+    router = make_router(pattern)
+    assert find(router, '/item/12') == (pattern, {'id': '12'})
+    with pytest.raises(KeyError):
+        router.match('/item/x')
@@ -0,0 +1,144 @@
+""" Order of DATA frames given by frame.Scheduler (RFC 7540 5.3). """
+from collections import namedtuple
+
+from server.frame import Scheduler
+
+Frame = namedtuple('Frame', ['stream', 'length'])
+
+
+def push(scheduler, stream_identifier, count, length=1000):
+    for _ in range(count):
+        scheduler.push(stream_identifier, Frame(stream_identifier, length))
+
+
+def pop_all(scheduler):
+    res = []
+    frame = scheduler.pop()
+    while frame is not None:
+        res.append(frame.stream)
+        frame = scheduler.pop()
+    return res
+
+
+def interleave(weight1, weight3):
+    scheduler = Scheduler()
+    scheduler.add(1, weight=weight1)
+    scheduler.add(3, weight=weight3)
+    push(scheduler, 1, 8)
+    push(scheduler, 3, 24)
+    return pop_all(scheduler)
+
+
+def test_weights_share_bytes():
+    order = interleave(16, 48)
+    assert len(order) == 32
+    # 1 of every 4 frames for weight 16, 3 for weight 48
+    for i in range(0, 32, 4):
+        assert sorted(order[i:i + 4]) == [1, 3, 3, 3]
+    # ties are broken by the stream identifiers
+    assert order == interleave(16, 48)
+    assert order[:4] == [1, 3, 3, 3]
+
+
+def test_dependent_waits_for_parent():
+    scheduler = Scheduler()
+    scheduler.add(1)
+    scheduler.add(3, depends_on=1)
+    push(scheduler, 3, 2)
+    push(scheduler, 1, 3)
+    assert pop_all(scheduler) == [1, 1, 1, 3, 3]
+
+
+def test_dependent_sends_while_parent_is_idle():
+    scheduler = Scheduler()
+    scheduler.add(1)
+    scheduler.add(3, depends_on=1)
+    push(scheduler, 3, 2)
+    assert scheduler.pop().stream == 3
+    push(scheduler, 1, 1)
+    assert pop_all(scheduler) == [1, 3]
+
+
+def test_exclusive_insertion():
+    scheduler = Scheduler()
+    scheduler.add(1)
+    scheduler.add(3)
+    scheduler.add(5, exclusive=True)
+    assert [x.identifier for x in scheduler.root.children] == [5]
+    assert [x.identifier for x in scheduler.streams[5].children] == [1, 3]
+    push(scheduler, 1, 1)
+    push(scheduler, 3, 1)
+    push(scheduler, 5, 2)
+    assert pop_all(scheduler) == [5, 5, 1, 3]
+
+
+def test_prioritize_under_own_descendant():
+    # 1 -> 3 -> 5, then 1 is made dependent on 5 (RFC 7540 5.3.3)
+    scheduler = Scheduler()
+    scheduler.add(1)
+    scheduler.add(3, depends_on=1)
+    scheduler.add(5, depends_on=3)
+    scheduler.prioritize(1, depends_on=5)
+    streams = scheduler.streams
+    assert streams[5].parent is scheduler.root
+    assert streams[1].parent is streams[5]
+    assert streams[3].parent is streams[1]
+    push(scheduler, 1, 1)
+    push(scheduler, 3, 1)
+    push(scheduler, 5, 1)
+    assert pop_all(scheduler) == [5, 1, 3]
+
+
+def test_prioritize_on_itself_is_an_error():
+    scheduler = Scheduler()
+    scheduler.add(1)
+    try:
+        scheduler.prioritize(1, depends_on=1)
+    except ValueError:
+        pass
+    else:
+        assert False, 'ValueError is not raised'
+
+
+def test_close_redistributes_weight():
+    # 1 (weight 32) has children 3 (weight 16) and 5 (weight 48), 7 (weight 64) is a sibling of 1
+    scheduler = Scheduler()
+    scheduler.add(1, weight=32)
+    scheduler.add(3, depends_on=1, weight=16)
+    scheduler.add(5, depends_on=1, weight=48)
+    scheduler.add(7, weight=64)
+    scheduler.close(1)
+    streams = scheduler.streams
+    assert 1 not in scheduler
+    assert streams[3].parent is scheduler.root and streams[5].parent is scheduler.root
+    # the weight of 1 is shared in proportion to the weights of its children
+    assert (streams[3].weight, streams[5].weight) == (8, 24)
+
+    push(scheduler, 3, 2)
+    push(scheduler, 5, 6)
+    push(scheduler, 7, 16)
+    order = pop_all(scheduler)
+    for i in range(0, 24, 12):
+        assert sorted(order[i:i + 12]) == [3] + [5] * 3 + [7] * 8
+
+
+def test_close_after_frames_are_popped():
+    scheduler = Scheduler()
+    scheduler.add(1)
+    push(scheduler, 1, 2)
+    scheduler.close(1)
+    assert 1 in scheduler
+    assert pop_all(scheduler) == [1, 1]
+    assert 1 not in scheduler
+    assert len(scheduler) == 0
+
+
+def test_reset_drops_frames():
+    scheduler = Scheduler()
+    scheduler.add(1)
+    scheduler.add(3)
+    push(scheduler, 1, 2)
+    push(scheduler, 3, 2)
+    scheduler.reset(1)
+    assert scheduler.pending(1) == 0
+    assert pop_all(scheduler) == [3, 3]